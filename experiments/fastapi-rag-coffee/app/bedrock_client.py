@@ -1,5 +1,33 @@
+import time
 import httpx
 from .settings import settings
+from .tracing import tracer
+from .resilience import (
+    PRIORITY_ONLINE,
+    AdaptiveLimiter,
+    CircuitBreaker,
+    backoff_delay,
+)
+
+
+# Lambda maps Bedrock throttling to 429 and service-side failures to 5xx
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class BedrockProxyError(RuntimeError):
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _retry_after(r: httpx.Response) -> float | None:
+    v = r.headers.get("retry-after")
+    if not v:
+        return None
+    try:
+        return float(v)
+    except ValueError:
+        return None
 
 
 class BedrockProxy:
@@ -7,61 +35,181 @@ class BedrockProxy:
         if not base_url:
             raise ValueError("LAMBDA_API_URL is required")
         self.base_url = base_url
-
-    def embed(self, text: str) -> list[float]:
-        """Calls Lambda proxy with action=embed and returns embedding array."""
-        payload = {"action": "embed", "text": text}
-        r = httpx.post(
-            self.base_url,
-            json=payload,
+        self.limiter = AdaptiveLimiter(
+            initial=settings.bedrock_concurrency_initial,
+            min_limit=settings.bedrock_concurrency_min,
+            max_limit=settings.bedrock_concurrency_max,
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.bedrock_breaker_threshold,
+            reset_timeout=settings.bedrock_breaker_reset,
+        )
+        # Keep-alive client so the TLS handshake to the Lambda is paid once per worker
+        self._client = httpx.Client(
             headers={"accept": "application/json"},
-            timeout=60,
+            limits=httpx.Limits(max_connections=settings.bedrock_concurrency_max),
         )
-        try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise RuntimeError(f"Lambda embed failed: {r.status_code} {r.text[:400]}") from e
+
+    def _post(self, action: str, payload: dict, timeout: float, priority: str,
+              retry: bool = True) -> dict:
+        """POST to the Lambda with adaptive concurrency, retry and circuit breaking.
+
+        Throttling (429), 5xx and transport errors shrink the concurrency limit
+        and are retried with jittered exponential backoff; other 4xx fail at once.
+        `retry=False` makes a single attempt.
+        """
+        with tracer.span(f"bedrock.{action}", priority=priority) as sp:
+            # Lambda continues this trace (header for API GW, body field as a fallback)
+            payload = {**payload, "traceparent": sp.traceparent}
+            try:
+                data = self._post_with_retry(action, payload, timeout, priority, sp, retry)
+                for k, v in (data.get("usage") or {}).items():
+                    sp.set(f"bedrock.usage.{k}", v)  # token counts incl. prompt cache reads/writes
+                return data
+            finally:
+                sp.set("bedrock.concurrency_limit", self.limiter.limit)
+                sp.set("bedrock.circuit", self.breaker.state)
+
+    def _post_with_retry(self, action: str, payload: dict, timeout: float, priority: str, sp,
+                         retry: bool = True) -> dict:
+        attempts = max(0, settings.bedrock_max_retries) + 1 if retry else 1
+        last_err: Exception | None = None
+        headers = {"traceparent": payload["traceparent"]}
+        for attempt in range(attempts):
+            sp.set("bedrock.attempts", attempt + 1)
+            self.breaker.before_call()
+            retry_after = None
+            with self.limiter.slot(priority):
+                try:
+                    r = self._client.post(self.base_url, json=payload, headers=headers, timeout=timeout)
+                except httpx.TransportError as e:
+                    self.limiter.on_overload()
+                    self.breaker.on_failure()
+                    last_err = BedrockProxyError(f"Lambda {action} transport error: {e}")
+                    r = None
+                except Exception as e:
+                    # Not an overload signal (bad URL, redirect loop, undecodable body), but the
+                    # breaker must still hear about it or a half-open probe is never released
+                    self.breaker.on_neutral()
+                    raise BedrockProxyError(f"Lambda {action} request failed: {e}") from e
+                except BaseException:
+                    self.breaker.on_neutral()
+                    raise
+            if r is not None:
+                sp.set("http.status_code", r.status_code)
+                if r.status_code in RETRYABLE_STATUS:
+                    self.limiter.on_overload()
+                    self.breaker.on_failure()
+                    retry_after = _retry_after(r)
+                    last_err = BedrockProxyError(
+                        f"Lambda {action} failed: {r.status_code} {r.text[:400]}", r.status_code
+                    )
+                elif r.is_error:
+                    self.breaker.on_neutral()
+                    raise BedrockProxyError(
+                        f"Lambda {action} failed: {r.status_code} {r.text[:400]}", r.status_code
+                    )
+                else:
+                    self.limiter.on_success()
+                    self.breaker.on_success()
+                    return self._parse_json(action, r)
+            if attempt + 1 < attempts:
+                time.sleep(backoff_delay(
+                    attempt, settings.bedrock_backoff_base, settings.bedrock_backoff_cap, retry_after
+                ))
+        assert last_err is not None
+        raise last_err
+
+    @staticmethod
+    def _parse_json(action: str, r: httpx.Response) -> dict:
         ct = r.headers.get("content-type", "")
         text_body = r.text or ""
         if "application/json" not in ct:
-            raise RuntimeError(f"Lambda embed returned non-JSON ({ct}): {text_body[:400]}")
+            raise BedrockProxyError(f"Lambda {action} returned non-JSON ({ct}): {text_body[:400]}")
         try:
-            data = r.json()
+            return r.json()
         except Exception as e:  # pragma: no cover
-            raise RuntimeError(f"Lambda embed returned invalid JSON: {text_body[:400]}") from e
+            raise BedrockProxyError(f"Lambda {action} returned invalid JSON: {text_body[:400]}") from e
+
+    def embed(self, text: str, priority: str = PRIORITY_ONLINE, timeout: float = 60,
+              retry: bool = True) -> list[float]:
+        """Calls Lambda proxy with action=embed and returns embedding array."""
+        payload = {"action": "embed", "text": text}
+        data = self._post("embed", payload, timeout=timeout, priority=priority, retry=retry)
         emb = data.get("embedding")
         if not isinstance(emb, list):
             raise RuntimeError("Invalid embedding response: missing 'embedding' list")
         return [float(x) for x in emb]
 
-    def generate(self, system: str, user_text: str, max_tokens: int) -> str:
+    def embed_batch(self, texts: list[str], priority: str = PRIORITY_ONLINE) -> list[list[float]]:
+        """Embeds several texts in one Lambda round trip (action=embed with `texts`).
+
+        The Lambda reports failures per item; only throttled / 5xx items are
+        resent (with backoff), so items that already succeeded are not re-embedded.
+        """
+        if not texts:
+            return []
+        out: list[list[float] | None] = [None] * len(texts)
+        pending = list(range(len(texts)))
+        attempts = max(0, settings.bedrock_max_retries) + 1
+        for attempt in range(attempts):
+            payload = {"action": "embed", "texts": [texts[i] for i in pending]}
+            data = self._post("embed", payload, timeout=120, priority=priority)
+            embs = data.get("embeddings")
+            if not isinstance(embs, list) or len(embs) != len(pending):
+                raise RuntimeError("Invalid embedding response: missing 'embeddings' list")
+            errors = {e.get("index"): e for e in data.get("errors") or [] if isinstance(e, dict)}
+            failed = []
+            for j, (i, emb) in enumerate(zip(pending, embs)):
+                if isinstance(emb, list):
+                    out[i] = [float(x) for x in emb]
+                    continue
+                err = errors.get(j) or {}
+                if err.get("status") not in RETRYABLE_STATUS:
+                    raise BedrockProxyError(
+                        f"Lambda embed failed for item {i}: {err.get('error')} {err.get('message')}",
+                        err.get("status"),
+                    )
+                failed.append(i)
+            if not failed:
+                return out  # type: ignore[return-value]
+            # Partial throttling still means we are over Bedrock's budget
+            self.limiter.on_overload()
+            pending = failed
+            if attempt + 1 < attempts:
+                time.sleep(backoff_delay(attempt, settings.bedrock_backoff_base, settings.bedrock_backoff_cap))
+        raise BedrockProxyError(
+            f"Lambda embed: {len(pending)} of {len(texts)} items still failing after {attempts} attempts", 429
+        )
+
+    def generate(self, system: str, user_text: str | list[dict], max_tokens: int,
+                 priority: str = PRIORITY_ONLINE) -> str:
+        return self.generate_with_usage(system, user_text, max_tokens, priority)[0]
+
+    def generate_with_usage(self, system: str, user_text: str | list[dict], max_tokens: int,
+                            priority: str = PRIORITY_ONLINE) -> tuple[str, dict]:
+        """Returns (text, usage). `user_text` may be prompt.build_user_blocks() output,
+        whose `cache` flags become prompt cache points when PROMPT_CACHE is on."""
         payload = {
             "action": "generate",
             "system": system,
-            "userText": user_text,
             "maxTokens": max_tokens,
             # Ask Lambda to return JSON explicitly
             "json": True,
         }
-        r = httpx.post(
-            self.base_url,
-            json=payload,
-            headers={"accept": "application/json"},
-            timeout=120,
-        )
-        try:
-            r.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise RuntimeError(f"Lambda generate failed: {r.status_code} {r.text[:400]}") from e
-        ct = r.headers.get("content-type", "")
-        text_body = r.text or ""
-        if "application/json" not in ct:
-            raise RuntimeError(f"Lambda generate returned non-JSON ({ct}): {text_body[:400]}")
-        try:
-            data = r.json()
-        except Exception as e:  # pragma: no cover
-            raise RuntimeError(f"Lambda generate returned invalid JSON: {text_body[:400]}") from e
-        return data.get("text", "")
+        if isinstance(user_text, str):
+            payload["userText"] = user_text
+        else:
+            payload["userBlocks"] = [
+                {"text": b["text"], "cachePoint": bool(b.get("cache")) and settings.prompt_cache}
+                for b in user_text
+            ]
+        payload["cacheSystem"] = settings.prompt_cache
+        data = self._post("generate", payload, timeout=120, priority=priority)
+        return data.get("text", ""), data.get("usage") or {}
+
+    def close(self) -> None:
+        self._client.close()
 
 
 bedrock = BedrockProxy(settings.lambda_api_url) if settings.lambda_api_url else None
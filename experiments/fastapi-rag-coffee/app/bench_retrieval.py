@@ -0,0 +1,290 @@
+"""Retrieval quality-vs-latency benchmark: recall@k of approximate vs exact search.
+
+Ground truth is the current brute-force CTE (`rag_retrieve`). Each candidate
+configuration runs an index-friendly query instead: take the nearest
+`k * overfetch` chunks with `ORDER BY <expr> <=> q LIMIT n` (which an HNSW /
+IVFFlat index can serve), then keep the best chunk per document.
+
+Indexes are created inside a transaction that is rolled back, so the schema
+is left untouched. CREATE INDEX blocks writes to `chunks` while it runs:
+point this at a staging copy for large tables.
+
+    python -m app.bench_retrieval --source synthetic --queries 200 \\
+        --index none,hnsw,ivfflat --ef-search 40,100,200 --probes 1,10 \\
+        --quant off,on --dims full,512 --out bench.json
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from .db import get_conn
+from .bedrock_client import bedrock
+from .resilience import PRIORITY_BATCH
+from .retrieval import retrieve
+from .cache_warmer import NORMALIZED_QUERY_SQL
+from .utils import vector_literal
+
+
+def _first(row: Any) -> Any:
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _parse_vec(text: str) -> list[float]:
+    return [float(x) for x in text.strip("[]").split(",") if x]
+
+
+def stored_dim(conn: Any) -> int:
+    with conn.cursor() as cur:
+        cur.execute("SELECT vector_dims(embedding) FROM chunks LIMIT 1")
+        row = cur.fetchone()
+    if row is None:
+        raise RuntimeError("chunks is empty; run /documents/build first")
+    return int(_first(row))
+
+
+def synthetic_queries(conn: Any, n: int, noise: float) -> list[str]:
+    """Stored chunk embeddings with gaussian noise scaled to the vector norm."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT embedding::text FROM chunks ORDER BY random() LIMIT %s", (n,))
+        rows = cur.fetchall()
+    out = []
+    for r in rows:
+        v = _parse_vec(_first(r))
+        sigma = noise * math.sqrt(sum(x * x for x in v) / max(len(v), 1))
+        out.append(vector_literal([x + random.gauss(0.0, sigma) for x in v]))
+    return out
+
+
+def rec_logs_queries(conn: Any, n: int) -> list[str]:
+    """Most frequent normalized queries; embeddings come from query_cache when present."""
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT h.query_text, qc.embedding::text
+            FROM (
+              SELECT {NORMALIZED_QUERY_SQL} AS norm,
+                     mode() WITHIN GROUP (ORDER BY query_text) AS query_text,
+                     count(*) AS hits
+              FROM rec_logs
+              WHERE query_text IS NOT NULL
+              GROUP BY 1
+              ORDER BY hits DESC
+              LIMIT %s
+            ) h
+            LEFT JOIN query_cache qc ON qc.norm_query = h.norm
+            """,
+            (n,),
+        )
+        rows = cur.fetchall()
+    out = []
+    for r in rows:
+        q, emb = (r["query_text"], r["embedding"]) if isinstance(r, dict) else (r[0], r[1])
+        if emb is None:
+            if not bedrock:
+                raise RuntimeError("LAMBDA_API_URL not configured; cannot embed rec_logs queries")
+            emb = vector_literal(bedrock.embed(q, priority=PRIORITY_BATCH))
+        out.append(emb)
+    return out
+
+
+def _exprs(dim: int, reduce_to: Optional[int], quant: bool) -> tuple[str, str, str]:
+    """(column expression, query expression template, operator class) for a config."""
+    d = reduce_to or dim
+    vtype = f"halfvec({d})" if quant else f"vector({d})"
+    ops = "halfvec_cosine_ops" if quant else "vector_cosine_ops"
+    if reduce_to:
+        col = f"(subvector(embedding, 1, {d})::{vtype})"
+        q = f"(subvector(%s::vector, 1, {d})::{vtype})"
+    else:
+        col = f"(embedding::{vtype})"
+        q = f"(%s::vector::{vtype})"
+    return col, q, ops
+
+
+def _approx_sql(col: str, q: str) -> str:
+    return f"""
+    WITH cand AS (
+      SELECT c.id AS chunk_id, {col} <=> {q} AS distance
+      FROM chunks c
+      ORDER BY {col} <=> {q}
+      LIMIT %s
+    ), ranked AS (
+      SELECT o.doc_id, o.chunk_index, cand.distance,
+             ROW_NUMBER() OVER (PARTITION BY o.doc_id ORDER BY cand.distance) AS rn
+      FROM cand
+      JOIN chunk_owners o ON o.chunk_id = cand.chunk_id
+    )
+    SELECT doc_id, chunk_index, distance
+    FROM ranked
+    WHERE rn = 1
+    ORDER BY distance
+    LIMIT %s
+    """
+
+
+def _percentile(xs: list[float], p: float) -> float:
+    if not xs:
+        return 0.0
+    s = sorted(xs)
+    i = min(len(s) - 1, max(0, math.ceil(p / 100.0 * len(s)) - 1))
+    return s[i]
+
+
+def _score(truth: list[dict], got: list[tuple[int, int]], k: int) -> tuple[float, bool, float]:
+    """(recall@k, result has one row per document, share of hits whose best chunk matches)."""
+    truth_docs = {t["doc_id"]: t["chunk_index"] for t in truth[:k]}
+    got_docs = [g[0] for g in got]
+    dedup_ok = len(got_docs) == len(set(got_docs))
+    hits = [g for g in got if g[0] in truth_docs]
+    recall = len({g[0] for g in hits}) / max(len(truth_docs), 1)
+    chunk_match = (sum(1 for g in hits if truth_docs[g[0]] == g[1]) / len(hits)) if hits else 1.0
+    return recall, dedup_ok, chunk_match
+
+
+def _build_grid(args: argparse.Namespace, dim: int) -> list[dict]:
+    grid = []
+    dims = [None if d == "full" else int(d) for d in args.dims.split(",")]
+    quants = [q == "on" for q in args.quant.split(",")]
+    for index, reduce_to, quant in itertools.product(args.index.split(","), dims, quants):
+        if reduce_to is not None and reduce_to >= dim:
+            continue
+        base = {"index": index, "dim": reduce_to or dim, "quant": quant}
+        if index == "hnsw":
+            for ef in [int(x) for x in args.ef_search.split(",")]:
+                grid.append({**base, "ef_search": ef})
+        elif index == "ivfflat":
+            for p in [int(x) for x in args.probes.split(",")]:
+                grid.append({**base, "probes": p})
+        elif index == "none":
+            grid.append(base)
+        else:
+            raise ValueError(f"unknown index type: {index}")
+    return grid
+
+
+def run_config(conn: Any, cfg: dict, dim: int, queries: list[str], truth: list[list[dict]],
+               k: int, overfetch: int, lists: int) -> dict:
+    reduce_to = cfg["dim"] if cfg["dim"] != dim else None
+    col, q, ops = _exprs(dim, reduce_to, cfg["quant"])
+    sql = _approx_sql(col, q)
+    build_ms = 0.0
+    recalls, chunk_matches, lat = [], [], []
+    dedup_ok = 0
+    with conn.cursor() as cur:
+        cur.execute("BEGIN")
+        try:
+            if cfg["index"] != "none":
+                with_opts = f"WITH (lists = {lists})" if cfg["index"] == "ivfflat" else ""
+                t0 = time.perf_counter()
+                cur.execute(f"CREATE INDEX bench_chunks_ann ON chunks USING {cfg['index']} ({col} {ops}) {with_opts}")
+                build_ms = (time.perf_counter() - t0) * 1000
+                cur.execute("ANALYZE chunks")
+            if "ef_search" in cfg:
+                cur.execute(f"SET LOCAL hnsw.ef_search = {int(cfg['ef_search'])}")
+            if "probes" in cfg:
+                cur.execute(f"SET LOCAL ivfflat.probes = {int(cfg['probes'])}")
+            for qv, t in zip(queries, truth):
+                t0 = time.perf_counter()
+                cur.execute(sql, (qv, qv, k * overfetch, k))
+                rows = cur.fetchall()
+                lat.append((time.perf_counter() - t0) * 1000)
+                got = [(r["doc_id"], r["chunk_index"]) if isinstance(r, dict) else (r[0], r[1]) for r in rows]
+                recall, ok, cm = _score(t, got, k)
+                recalls.append(recall)
+                chunk_matches.append(cm)
+                dedup_ok += int(ok)
+        finally:
+            cur.execute("ROLLBACK")
+    n = max(len(queries), 1)
+    return {
+        **cfg,
+        "recall_at_k": round(statistics.fmean(recalls), 4) if recalls else 0.0,
+        "dedup_ok": round(dedup_ok / n, 4),
+        "best_chunk_match": round(statistics.fmean(chunk_matches), 4) if chunk_matches else 0.0,
+        "p50_ms": round(_percentile(lat, 50), 2),
+        "p99_ms": round(_percentile(lat, 99), 2),
+        "index_build_ms": round(build_ms, 1),
+    }
+
+
+def run(args: argparse.Namespace) -> dict:
+    conn = get_conn()
+    dim = stored_dim(conn)
+    if args.source == "rec_logs":
+        queries = rec_logs_queries(conn, args.queries)
+    else:
+        queries = synthetic_queries(conn, args.queries, args.noise)
+    if not queries:
+        raise RuntimeError(f"no queries available from source={args.source}")
+
+    # Ground truth with the exact brute-force CTE
+    truth, exact_lat = [], []
+    for qv in queries:
+        t0 = time.perf_counter()
+        truth.append(retrieve(qv, args.k, conn))
+        exact_lat.append((time.perf_counter() - t0) * 1000)
+    results = [{
+        "index": "exact-cte", "dim": dim, "quant": False,
+        "recall_at_k": 1.0, "dedup_ok": 1.0, "best_chunk_match": 1.0,
+        "p50_ms": round(_percentile(exact_lat, 50), 2),
+        "p99_ms": round(_percentile(exact_lat, 99), 2),
+        "index_build_ms": 0.0,
+    }]
+    for cfg in _build_grid(args, dim):
+        results.append(run_config(conn, cfg, dim, queries, truth, args.k, args.overfetch, args.lists))
+    return {
+        "run_at": datetime.now(timezone.utc).isoformat(),
+        "source": args.source,
+        "queries": len(queries),
+        "k": args.k,
+        "overfetch": args.overfetch,
+        "stored_dim": dim,
+        "results": results,
+    }
+
+
+def format_table(report: dict) -> str:
+    cols = ["index", "dim", "quant", "ef_search", "probes", "recall_at_k", "dedup_ok",
+            "best_chunk_match", "p50_ms", "p99_ms", "index_build_ms"]
+    rows = [[str(r.get(c, "")) for c in cols] for r in report["results"]]
+    widths = [max(len(c), *(len(r[i]) for r in rows)) for i, c in enumerate(cols)]
+
+    def line(vals: list[str]) -> str:
+        return "  ".join(v.ljust(w) for v, w in zip(vals, widths)).rstrip()
+
+    return "\n".join([line(cols), line(["-" * w for w in widths])] + [line(r) for r in rows])
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="recall@k / latency sweep of approximate vs exact retrieval")
+    ap.add_argument("--source", choices=("rec_logs", "synthetic"), default="synthetic")
+    ap.add_argument("--queries", type=int, default=100)
+    ap.add_argument("--noise", type=float, default=0.05, help="synthetic query noise (relative to RMS)")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--overfetch", type=int, default=4, help="ANN candidates = k * overfetch before dedup")
+    ap.add_argument("--index", default="none,hnsw,ivfflat")
+    ap.add_argument("--ef-search", default="40,100,200")
+    ap.add_argument("--probes", default="1,10")
+    ap.add_argument("--lists", type=int, default=100, help="ivfflat lists")
+    ap.add_argument("--quant", default="off", help="off,on (halfvec)")
+    ap.add_argument("--dims", default="full", help="full or reduced dims, e.g. full,512")
+    ap.add_argument("--out", help="write JSON report here as well")
+    args = ap.parse_args(argv)
+
+    report = run(args)
+    print(format_table(report))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Precomputed answers for the hottest queries mined from rec_logs.
+
+`warm()` groups recent `rec_logs.query_text` by normalized text, embeds the
+top N queries, stores their retrievals (and optionally full answers) in
+`query_cache`. `/search` and `/recommend` look there first, so the head of
+the query distribution is served without a Bedrock call.
+
+Run after every `/documents/build` (done automatically), via
+`POST /cache/warm`, or from cron:
+    python -m app.cache_warmer
+"""
+import json
+import sys
+from typing import Any, Optional
+
+from .settings import settings
+from .db import get_conn, get_read_conn, mark_primary_write
+from .bedrock_client import bedrock
+from .resilience import PRIORITY_BATCH
+from .retrieval import retrieve
+from .dedup import collapse_shared
+from .prompt import build_system_prompt, build_user_blocks
+from .utils import normalize_query, vector_literal
+
+
+# Retrieval depth stored per query; covers /search (k<=50) and /recommend (top_k<=32)
+CACHE_DEPTH = 50
+
+# Grouping key for mining: rec_logs.norm_query (utils.normalize_query() at insert time).
+# Rows logged before that column existed fall back to an SQL approximation; warm() re-keys
+# every group with normalize_query() so query_cache keys always match lookup().
+NORMALIZED_QUERY_SQL = "coalesce(norm_query, lower(regexp_replace(btrim(query_text), '\\s+', ' ', 'g')))"
+
+
+def mine_hot_queries(limit: int, lookback_days: int, conn: Optional[Any] = None) -> list[dict]:
+    conn = conn or get_conn()
+    with conn.cursor() as cur:
+        cur.execute(
+            f"""
+            SELECT {NORMALIZED_QUERY_SQL} AS norm,
+                   mode() WITHIN GROUP (ORDER BY query_text) AS query_text,
+                   mode() WITHIN GROUP (ORDER BY top_k) AS top_k,
+                   count(*) AS hits
+            FROM rec_logs
+            WHERE query_text IS NOT NULL
+              AND created_at >= now() - make_interval(days => %s)
+            GROUP BY 1
+            HAVING {NORMALIZED_QUERY_SQL} <> ''
+            ORDER BY hits DESC
+            LIMIT %s
+            """,
+            (lookback_days, limit),
+        )
+        rows = cur.fetchall()
+    merged: dict[str, dict] = {}
+    for r in rows:
+        if isinstance(r, dict):
+            q, top_k, hits = r["query_text"], r["top_k"], int(r["hits"])
+        else:
+            q, top_k, hits = r[1], r[2], int(r[3])
+        norm = normalize_query(q)
+        if not norm:
+            continue
+        if norm in merged:
+            # Legacy SQL keys can split one Python key into several groups
+            merged[norm]["hits"] += hits
+        else:
+            merged[norm] = {"norm": norm, "query_text": q, "top_k": top_k, "hits": hits}
+    return sorted(merged.values(), key=lambda h: -h["hits"])
+
+
+def warm(limit: Optional[int] = None, with_answers: Optional[bool] = None) -> dict:
+    if not bedrock:
+        return {"ok": False, "error": "LAMBDA_API_URL not configured"}
+    limit = limit or settings.query_cache_size
+    if with_answers is None:
+        with_answers = settings.query_cache_answers
+    conn = get_conn()
+    hot = mine_hot_queries(limit, settings.query_cache_lookback_days, conn)
+
+    warmed = 0
+    answered = 0
+    for h in hot:
+        qvec = bedrock.embed(h["query_text"], priority=PRIORITY_BATCH)
+        vstr = vector_literal(qvec)
+        results = retrieve(vstr, CACHE_DEPTH, conn)
+        top_k = min(max(int(h["top_k"] or 16), 1), 32)
+        answer = None
+        if with_answers:
+            # Same contexts as /recommend, so the answer matches and its prompt cache prefix is shared
+            contexts = collapse_shared(results[:top_k])
+            answer = bedrock.generate(
+                build_system_prompt(),
+                build_user_blocks(h["query_text"], contexts),
+                settings.max_tokens,
+                priority=PRIORITY_BATCH,
+            )
+            answered += 1
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO query_cache (norm_query, query_text, embedding, results, answer_top_k, answer, hits, built_at)
+                VALUES (%s, %s, %s::vector, %s::jsonb, %s, %s, %s, now())
+                ON CONFLICT (norm_query) DO UPDATE SET
+                  query_text = EXCLUDED.query_text,
+                  embedding = EXCLUDED.embedding,
+                  results = EXCLUDED.results,
+                  answer_top_k = EXCLUDED.answer_top_k,
+                  answer = EXCLUDED.answer,
+                  hits = EXCLUDED.hits,
+                  built_at = EXCLUDED.built_at
+                """,
+                (h["norm"], h["query_text"], vstr, json.dumps(results, ensure_ascii=False),
+                 top_k if answer is not None else None, answer, h["hits"]),
+            )
+        warmed += 1
+
+    # Drop entries that fell out of the hot set
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM query_cache WHERE NOT (norm_query = ANY(%s::text[]))",
+            ([h["norm"] for h in hot],),
+        )
+    mark_primary_write()
+    return {"ok": True, "queries": warmed, "answers": answered}
+
+
+def lookup(query: str, conn: Optional[Any] = None) -> Optional[dict]:
+    """Returns the cached entry for a query, or None on miss."""
+    if settings.query_cache_size <= 0:
+        return None
+    conn = conn or get_read_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT embedding::text, results, answer_top_k, answer
+                FROM query_cache WHERE norm_query = %s
+                """,
+                (normalize_query(query),),
+            )
+            r = cur.fetchone()
+    except Exception:
+        # A replica hiccup should only cost a cache miss
+        if conn is get_conn():
+            raise
+        return None
+    if r is None:
+        return None
+    if isinstance(r, dict):
+        vstr, results, answer_top_k, answer = r["embedding"], r["results"], r["answer_top_k"], r["answer"]
+    else:
+        vstr, results, answer_top_k, answer = r
+    if isinstance(results, str):
+        results = json.loads(results)
+    return {"vstr": vstr, "results": results, "answer_top_k": answer_top_k, "answer": answer}
+
+
+def main() -> int:
+    print(json.dumps(warm(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
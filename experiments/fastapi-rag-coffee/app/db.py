@@ -1,5 +1,12 @@
-from typing import Optional, Any
+import itertools
+import json
+import re
+import threading
+import time
+from typing import Optional, Any, Sequence
 from .settings import settings
+from .tracing import tracer
+from .utils import normalize_query
 
 try:
     import psycopg  # type: ignore
@@ -21,29 +28,290 @@ if not _HAS_PSYCOPG3:
 _pool: Optional[Any] = None
 
 
+def _connect(dsn: Optional[str] = None) -> Any:
+    """Opens an autocommit connection to the primary (dsn=None) or to a given DSN."""
+    kwargs: dict = {"conninfo": dsn} if dsn else dict(
+        host=settings.db_host,
+        port=settings.db_port,
+        dbname=settings.db_name,
+        user=settings.db_user,
+        password=settings.db_password,
+    )
+    # libpq waits forever by default; an unreachable replica must not hang its caller
+    timeout = settings.db_connect_timeout
+    if _HAS_PSYCOPG3:
+        return psycopg.connect(autocommit=True, connect_timeout=timeout, **kwargs)  # type: ignore
+    if dsn:
+        kwargs = {"dsn": dsn}
+    conn = psycopg2.connect(  # type: ignore
+        cursor_factory=psycopg2.extras.RealDictCursor,  # type: ignore
+        connect_timeout=timeout,
+        **kwargs,
+    )
+    conn.autocommit = True
+    return conn
+
+
 def get_conn() -> Any:
+    """Primary connection: all writes, and reads that must see them."""
     global _pool
     if _pool is None:
-        if _HAS_PSYCOPG3:
-            _pool = psycopg.connect(  # type: ignore
-                host=settings.db_host,
-                port=settings.db_port,
-                dbname=settings.db_name,
-                user=settings.db_user,
-                password=settings.db_password,
-                autocommit=True,
+        _pool = _connect()
+    return _pool
+
+
+def open_dedicated_conn() -> Any:
+    """Separate primary connection for work that holds a transaction open (bulk import).
+
+    The shared `get_conn()` connection is used by every request thread, so a
+    transaction on it would swallow their writes. Caller closes it.
+    """
+    return _connect()
+
+
+def _first(row: Any) -> Any:
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _lsn_to_int(lsn: Optional[str]) -> int:
+    if not lsn:
+        return 0
+    hi, lo = str(lsn).split("/")
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+
+class _Replica:
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.conn: Optional[Any] = None
+        self.healthy = True
+        self.latency_ms: Optional[float] = None
+        self.replay_lsn = 0
+        self.checked_at = 0.0
+
+    def check(self) -> bool:
+        """Measures round-trip latency and replay position; marks the replica down on error."""
+        t0 = time.monotonic()
+        try:
+            if self.conn is None:
+                self.conn = _connect(self.dsn)
+            with self.conn.cursor() as cur:
+                cur.execute("SELECT pg_last_wal_replay_lsn()::text")
+                self.replay_lsn = _lsn_to_int(_first(cur.fetchone()))
+            ms = (time.monotonic() - t0) * 1000
+            # EWMA so a single slow probe does not flip the routing
+            self.latency_ms = ms if self.latency_ms is None else 0.7 * self.latency_ms + 0.3 * ms
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+            self.drop()
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+    def drop(self) -> None:
+        if self.conn is not None:
+            _prepared.pop(id(self.conn), None)
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+
+_replicas: list[_Replica] = [_Replica(d) for d in settings.db_replica_dsns]
+_rr = itertools.count()
+_route_lock = threading.Lock()
+# Primary WAL position replicas must have replayed before serving reads (read-your-writes)
+_min_read_lsn = 0
+# Health checks (which may reconnect) run on a background thread, never on the request path
+_health_thread: Optional[threading.Thread] = None
+_health_wake = threading.Event()
+
+
+def _lagging() -> bool:
+    return any(r.healthy and r.replay_lsn < _min_read_lsn for r in _replicas)
+
+
+def _raise_read_floor(lsn: int) -> None:
+    global _min_read_lsn
+    with _route_lock:
+        _min_read_lsn = max(_min_read_lsn, lsn)
+
+
+def _refresh_shared_floor() -> None:
+    """Picks up writes made by other workers from replica_read_floor on the primary."""
+    try:
+        with get_conn().cursor() as cur:
+            cur.execute("SELECT lsn::text FROM replica_read_floor")
+            row = cur.fetchone()
+    except Exception:
+        return  # table missing before /init-db, or primary briefly unavailable
+    if row is not None:
+        _raise_read_floor(_lsn_to_int(_first(row)))
+
+
+def _health_loop() -> None:
+    while True:
+        if settings.db_read_your_writes:
+            _refresh_shared_floor()
+        now = time.monotonic()
+        for r in _replicas:
+            due = now - r.checked_at >= settings.db_replica_health_interval
+            # Re-probe quickly only while it is still catching up with the last write
+            if due or (r.healthy and r.replay_lsn < _min_read_lsn):
+                r.check()
+        # Tick at least every second so other workers' writes are noticed quickly
+        _health_wake.wait(0.2 if _lagging() else min(1.0, settings.db_replica_health_interval))
+        _health_wake.clear()
+
+
+def _start_health_checks() -> None:
+    global _health_thread
+    if _health_thread is not None or not _replicas:
+        return
+    with _route_lock:
+        if _health_thread is None:
+            _health_thread = threading.Thread(target=_health_loop, name="replica-health", daemon=True)
+            _health_thread.start()
+
+
+def mark_primary_write() -> None:
+    """Records the primary's current WAL LSN; later reads avoid replicas that lag behind it.
+
+    The position is also stored in replica_read_floor so the other workers
+    (each with its own replica state) honour it on their next health tick.
+    """
+    if not _replicas or not settings.db_read_your_writes:
+        return
+    with get_conn().cursor() as cur:
+        try:
+            cur.execute(
+                """
+                INSERT INTO replica_read_floor (id, lsn) VALUES (TRUE, pg_current_wal_lsn())
+                ON CONFLICT (id) DO UPDATE SET lsn = GREATEST(replica_read_floor.lsn, EXCLUDED.lsn)
+                RETURNING lsn::text
+                """
             )
+        except Exception:
+            # Schema not applied yet: fall back to this worker only
+            cur.execute("SELECT pg_current_wal_lsn()::text")
+        lsn = _lsn_to_int(_first(cur.fetchone()))
+    _raise_read_floor(lsn)
+    _health_wake.set()
+
+
+def get_read_conn() -> Any:
+    """Connection for read-only retrieval: a healthy, caught-up replica, else the primary."""
+    if not _replicas:
+        return get_conn()
+    _start_health_checks()
+    with _route_lock:
+        candidates = [
+            r for r in _replicas
+            if r.healthy and r.conn is not None and r.replay_lsn >= _min_read_lsn
+        ]
+        if not candidates:
+            return get_conn()
+        if settings.db_replica_strategy == "least_latency":
+            chosen = min(candidates, key=lambda r: r.latency_ms or 0.0)
         else:
-            _pool = psycopg2.connect(  # type: ignore
-                host=settings.db_host,
-                port=settings.db_port,
-                dbname=settings.db_name,
-                user=settings.db_user,
-                password=settings.db_password,
-                cursor_factory=psycopg2.extras.RealDictCursor,  # type: ignore
-            )
-            _pool.autocommit = True
-    return _pool
+            chosen = candidates[next(_rr) % len(candidates)]
+    return chosen.conn
+
+
+def replica_status() -> list[dict]:
+    return [
+        {
+            "dsn": _redact(r.dsn),
+            "healthy": r.healthy,
+            "latency_ms": None if r.latency_ms is None else round(r.latency_ms, 2),
+            "caught_up": r.replay_lsn >= _min_read_lsn,
+        }
+        for r in _replicas
+    ]
+
+
+def _redact(dsn: str) -> str:
+    dsn = re.sub(r"password=\S+", "password=***", dsn)
+    return re.sub(r"://([^:@/]+):[^@/]+@", r"://\1:***@", dsn)
+
+
+# Server-side prepared statements: name -> (parameter types, body using $n)
+_STATEMENTS: dict[str, tuple[str, str]] = {}
+# id(connection) -> names already PREPAREd on that session
+_prepared: dict[int, set[str]] = {}
+# Serializes PREPARE so concurrent first requests do not both prepare the same name
+_prepare_lock = threading.Lock()
+
+
+def register_statement(name: str, param_types: str, body: str) -> None:
+    """Declares a statement that is PREPAREd once per connection and run via EXECUTE."""
+    _STATEMENTS[name] = (param_types, body)
+
+
+def _client_cursor(conn: Any) -> Any:
+    # EXECUTE cannot take bind parameters, so interpolate client-side
+    if _HAS_PSYCOPG3:
+        return psycopg.ClientCursor(conn)  # type: ignore
+    return conn.cursor()
+
+
+def _ensure_prepared(conn: Any, name: str) -> None:
+    if name in _prepared.get(id(conn), ()):
+        return
+    with _prepare_lock:
+        done = _prepared.setdefault(id(conn), set())
+        if name in done:
+            return
+        param_types, body = _STATEMENTS[name]
+        with conn.cursor() as cur:
+            cur.execute(f"PREPARE {name} ({param_types}) AS {body}")
+        done.add(name)
+
+
+def prepare_statements(conn: Optional[Any] = None) -> list[str]:
+    conn = conn or get_conn()
+    for name in _STATEMENTS:
+        _ensure_prepared(conn, name)
+    return sorted(_prepared.get(id(conn), set()))
+
+
+def prepare_replicas() -> None:
+    """Connects to every replica and PREPAREs the statements there as well."""
+    for r in _replicas:
+        if r.check():
+            try:
+                prepare_statements(r.conn)
+            except Exception:
+                r.healthy = False
+                r.drop()
+    _start_health_checks()
+
+
+def execute_prepared(name: str, params: Sequence[Any], conn: Optional[Any] = None,
+                     fetch: bool = True) -> list:
+    conn = conn or get_conn()
+    try:
+        _ensure_prepared(conn, name)
+    except Exception:
+        _mark_failed(conn)
+        raise
+    placeholders = ", ".join(["%s"] * len(params))
+    try:
+        with _client_cursor(conn) as cur:
+            cur.execute(f"EXECUTE {name} ({placeholders})", tuple(params))
+            return cur.fetchall() if fetch else []
+    except Exception:
+        _mark_failed(conn)
+        raise
+
+
+def _mark_failed(conn: Any) -> None:
+    # Replica errors take it out of rotation until the next health check reconnects it
+    for r in _replicas:
+        if r.conn is conn:
+            r.healthy = False
+            r.drop()
 
 
 def apply_schema():
@@ -58,10 +326,76 @@ def apply_schema():
         sql = f.read()
     with conn.cursor() as cur:
         cur.execute(sql)
+    maintain_rec_logs()
+
+
+def maintain_rec_logs() -> list[str]:
+    """Creates upcoming rec_logs partitions and drops the ones past retention.
+
+    Returns the names of detached partitions. Safe to call repeatedly: every
+    worker runs it at startup and then every REC_LOGS_MAINTENANCE_HOURS, and an
+    advisory lock lets only one of them work at a time (the others return []).
+    """
+    # Own connection: the partition DDL takes locks that request threads should not queue behind
+    conn = open_dedicated_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(hashtext('rec_logs_maintenance'))")
+            if not _first(cur.fetchone()):
+                return []
+            try:
+                cur.execute(
+                    "SELECT rec_logs_ensure_partitions(now()::date, %s)",
+                    (settings.rec_logs_partitions_ahead,),
+                )
+                cur.execute(
+                    "SELECT * FROM rec_logs_apply_retention(%s, %s)",
+                    (settings.rec_logs_retention_months, settings.rec_logs_drop_detached),
+                )
+                rows = cur.fetchall()
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(hashtext('rec_logs_maintenance'))")
+        return [_first(r) for r in rows]
+    finally:
+        conn.close()
+
+
+register_statement(
+    "rag_log_rec",
+    "text, text, text, integer, jsonb, text, text",
+    """
+    INSERT INTO rec_logs (user_id, query_text, model, top_k, candidates, response_text, norm_query)
+    VALUES ($1, $2, $3, $4, $5, $6, $7)
+    """,
+)
+
+
+def log_recommendation(query: str, model: str, top_k: int, candidates: list, answer: str,
+                       user_id: Optional[str] = None) -> None:
+    with tracer.span("sql.rec_logs.insert"):
+        execute_prepared(
+            "rag_log_rec",
+            # norm_query is the query_cache key, computed here so mining never depends on SQL locale rules
+            (user_id, query, model, top_k, json.dumps(candidates), answer, normalize_query(query)),
+            fetch=False,
+        )
+
+
+def ping() -> bool:
+    try:
+        with get_conn().cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        return True
+    except Exception:
+        return False
 
 
 def close_conn():
     global _pool
+    for r in _replicas:
+        r.drop()
     if _pool is not None:
+        _prepared.pop(id(_pool), None)
         _pool.close()
         _pool = None
@@ -0,0 +1,176 @@
+"""Ingest-time chunk deduplication.
+
+Exact duplicates are detected by content hash before embedding (no embed
+call), near-duplicates by embedding distance afterwards. A duplicate is not
+stored again: the existing chunk gains another row in `chunk_owners`, and
+retrieval expands it back to every owning document.
+"""
+import hashlib
+import math
+from typing import Any, Callable, Optional, Sequence
+
+from .settings import settings
+from .utils import vector_literal
+
+
+def content_hash(text: str) -> str:
+    # Same as md5(content) in SQL (used by the schema backfill)
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def _cosine_distance(a: Sequence[float], b: Sequence[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    if na == 0 or nb == 0:
+        return 1.0
+    return 1.0 - dot / (na * nb)
+
+
+def _existing_by_hash(conn: Any, hashes: list[str]) -> dict[str, int]:
+    if not hashes:
+        return {}
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT content_hash, min(id) AS id FROM chunks WHERE content_hash = ANY(%s::text[]) GROUP BY 1",
+            (hashes,),
+        )
+        rows = cur.fetchall()
+    return {
+        (r["content_hash"] if isinstance(r, dict) else r[0]): (r["id"] if isinstance(r, dict) else r[1])
+        for r in rows
+    }
+
+
+def _nearest_within(conn: Any, vstr: str, max_distance: float) -> Optional[int]:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT id, embedding <=> %s::vector AS distance
+            FROM chunks
+            ORDER BY embedding <=> %s::vector
+            LIMIT 1
+            """,
+            (vstr, vstr),
+        )
+        r = cur.fetchone()
+    if r is None:
+        return None
+    cid, dist = (r["id"], r["distance"]) if isinstance(r, dict) else (r[0], r[1])
+    return cid if dist is not None and float(dist) <= max_distance else None
+
+
+def plan_chunks(conn: Any, texts: list[str],
+                embed_many: Callable[[list[str]], list[list[float]]],
+                near_distance: Optional[float] = None) -> dict:
+    """Read-only phase: hash lookup, embedding and near-duplicate matching.
+
+    Does no writes, so callers can run it before opening a transaction and
+    keep slow embed calls (and their retries) outside it.
+    """
+    if near_distance is None:
+        near_distance = settings.dedup_near_distance
+    hashes = [content_hash(c) for c in texts]
+    chunk_of: dict[str, int] = _existing_by_hash(conn, sorted(set(hashes)))
+    exact = sum(1 for h in hashes if h in chunk_of)
+
+    # First occurrence of each unseen hash gets embedded; later ones in the batch are exact dups
+    first: dict[str, int] = {}
+    for pos, h in enumerate(hashes):
+        if h not in chunk_of and h not in first:
+            first[h] = pos
+    exact += sum(1 for h in hashes if h in first) - len(first)
+
+    pending = list(first.items())
+    vectors = embed_many([texts[pos] for _, pos in pending]) if pending else []
+
+    new: list[tuple[str, int, list[float]]] = []  # (hash, position of first occurrence, vector)
+    alias: dict[str, str] = {}  # near-duplicate of another new chunk in this batch
+    near = 0
+    for (h, pos), vec in zip(pending, vectors):
+        if near_distance > 0:
+            match = _nearest_within(conn, vector_literal(vec), near_distance)
+            if match is not None:
+                chunk_of[h] = match
+                near += 1
+                continue
+            rep = next((nh for nh, _, v in new if _cosine_distance(v, vec) <= near_distance), None)
+            if rep is not None:
+                alias[h] = rep
+                near += 1
+                continue
+        new.append((h, pos, vec))
+    return {"hashes": hashes, "chunk_of": chunk_of, "new": new, "alias": alias,
+            "dedup_exact": exact, "dedup_near": near, "embedded": len(pending)}
+
+
+def write_chunks(conn: Any, plan: dict, texts: list[str], owners: list[tuple[int, int]]) -> dict:
+    """Write phase: inserts the planned new chunks and every (doc_id, chunk_index) owner row.
+
+    `texts` / `owners` are aligned with the texts given to plan_chunks().
+    """
+    chunk_of = dict(plan["chunk_of"])
+    with conn.cursor() as cur:
+        if plan["new"]:
+            # One multi-row INSERT per batch; hashes in plan["new"] are unique, so ids map back by hash
+            values = ", ".join(["(%s, %s, %s, %s::vector, %s)"] * len(plan["new"]))
+            params: list[Any] = []
+            for h, pos, vec in plan["new"]:
+                doc_id, idx = owners[pos]
+                params.extend([doc_id, idx, texts[pos], vector_literal(vec), h])
+            cur.execute(
+                f"""
+                INSERT INTO chunks (doc_id, chunk_index, content, embedding, content_hash)
+                VALUES {values}
+                RETURNING id, content_hash
+                """,
+                params,
+            )
+            for r in cur.fetchall():
+                cid, h = (r["id"], r["content_hash"]) if isinstance(r, dict) else (r[0], r[1])
+                chunk_of[h] = cid
+        for h, rep in plan["alias"].items():
+            chunk_of[h] = chunk_of[rep]
+
+        rows = [(chunk_of[h], doc_id, idx) for h, (doc_id, idx) in zip(plan["hashes"], owners)]
+        if rows:
+            values = ", ".join(["(%s, %s, %s)"] * len(rows))
+            cur.execute(
+                f"""
+                INSERT INTO chunk_owners (chunk_id, doc_id, chunk_index)
+                VALUES {values}
+                ON CONFLICT DO NOTHING
+                """,
+                [v for o in rows for v in o],
+            )
+    return {"chunks": len(plan["new"]), "dedup_exact": plan["dedup_exact"],
+            "dedup_near": plan["dedup_near"], "embedded": plan["embedded"]}
+
+
+def store_chunks(conn: Any, items: list[tuple[int, int, str]],
+                 embed_many: Callable[[list[str]], list[list[float]]],
+                 near_distance: Optional[float] = None) -> dict:
+    """Stores (doc_id, chunk_index, content) items, sharing duplicate chunks.
+
+    Returns counts: new chunks stored, exact / near duplicates collapsed and
+    texts sent for embedding.
+    """
+    texts = [c for _, _, c in items]
+    plan = plan_chunks(conn, texts, embed_many, near_distance)
+    return write_chunks(conn, plan, texts, [(d, i) for d, i, _ in items])
+
+
+def collapse_shared(rows: list[dict]) -> list[dict]:
+    """Merges retrieval rows that point at the same chunk into one prompt context."""
+    merged: dict[Any, dict] = {}
+    out: list[dict] = []
+    for r in rows:
+        key = r.get("chunk_id") or ("doc", r.get("doc_id"))
+        if key in merged:
+            if r.get("title"):
+                merged[key]["titles"].append(r["title"])
+            continue
+        ctx = {"titles": [r["title"]] if r.get("title") else [], "content": r["content"]}
+        merged[key] = ctx
+        out.append(ctx)
+    return [{"title": " / ".join(c["titles"]) or None, "content": c["content"]} for c in out]
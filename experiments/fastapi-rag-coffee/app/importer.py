@@ -0,0 +1,352 @@
+"""Streaming bulk import of tasting notes / brew logs into documents + chunks.
+
+Input is JSONL or CSV read incrementally; memory use depends only on the
+batch size, not on the file size. Each flushed batch reports the byte offset
+just past the last committed record so an interrupted import can resume
+with `offset=<next_offset>`.
+
+CLI:
+    python -m app.importer data/tastings.jsonl --type tasting
+    python -m app.importer data/brews.csv --type brew --offset 123456
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from typing import Any, Iterator, Optional
+
+from .settings import settings
+from .db import mark_primary_write, open_dedicated_conn
+from .bedrock_client import bedrock
+from .resilience import PRIORITY_BATCH
+from .dedup import plan_chunks, write_chunks
+from .utils import iter_chunks
+
+
+SOURCE_TYPES = ("tasting", "brew")
+FORMATS = ("jsonl", "csv")
+
+# Field order used when rendering a record into document text
+_FIELD_LABELS = {
+    "tasting": [
+        ("bean_name", "豆"),
+        ("liking", "好き度"),
+        ("score", "スコア"),
+        ("aroma", "香り"),
+        ("acidity", "酸味"),
+        ("sweetness", "甘さ"),
+        ("body", "ボディ"),
+        ("aftertaste", "余韻"),
+        ("flavor_notes", "フレーバーノート"),
+        ("notes", "メモ"),
+    ],
+    "brew": [
+        ("bean_name", "豆"),
+        ("method", "抽出方法"),
+        ("dose_g", "豆量(g)"),
+        ("water_g", "湯量(g)"),
+        ("water_temp_c", "湯温(℃)"),
+        ("grind", "挽き目"),
+        ("brew_time_sec", "抽出時間(秒)"),
+        ("notes", "メモ"),
+    ],
+}
+_META_KEYS = {"id", "source_id", "type", "source_type", "title", "created_at", "updated_at"}
+
+
+class RecordParser:
+    """Incremental JSONL/CSV parser fed with raw bytes.
+
+    `feed()` yields `(record, end_offset)` for every complete record, where
+    `end_offset` is the absolute byte offset right after that record.
+    """
+
+    def __init__(self, fmt: str, start_offset: int = 0, columns: Optional[list[str]] = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"unsupported format: {fmt}")
+        self.fmt = fmt
+        self.offset = start_offset
+        self.columns = columns
+        self._buf = bytearray()
+        self._pending: list[bytes] = []  # CSV record spanning several lines (quoted newline)
+        self._quotes = 0  # quote count of _pending
+
+    def feed(self, data: bytes) -> Iterator[tuple[dict, int]]:
+        self._buf += data
+        # Scan with a moving index and trim consumed bytes once per feed; slicing the
+        # remainder off per line made parsing quadratic in the chunk size
+        pos = 0
+        try:
+            while True:
+                nl = self._buf.find(b"\n", pos)
+                if nl == -1:
+                    return
+                line = bytes(self._buf[pos: nl + 1])
+                pos = nl + 1
+                rec = self._line(line)
+                if rec is not None:
+                    yield rec, self.offset
+        finally:
+            del self._buf[:pos]
+
+    def finish(self) -> Iterator[tuple[dict, int]]:
+        tail, self._buf = bytes(self._buf), bytearray()
+        if tail:
+            rec = self._line(tail)
+            if rec is not None:
+                yield rec, self.offset
+        if self._pending:
+            raise ValueError(f"unterminated quoted CSV field near byte {self.offset}")
+
+    def _line(self, line: bytes) -> Optional[dict]:
+        self.offset += len(line)
+        if self.fmt == "jsonl":
+            text = line.decode("utf-8").strip()
+            if not text:
+                return None
+            try:
+                obj = json.loads(text)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"invalid JSON line ending at byte {self.offset}: {e}") from e
+            if not isinstance(obj, dict):
+                raise ValueError(f"JSON line ending at byte {self.offset} is not an object")
+            return obj
+
+        self._pending.append(line)
+        self._quotes += line.count(b'"')
+        # An odd number of quotes means a quoted field continues on the next line
+        if self._quotes % 2 == 1:
+            return None
+        text = b"".join(self._pending).decode("utf-8")
+        self._pending, self._quotes = [], 0
+        if not text.strip():
+            return None
+        row = next(csv.reader(io.StringIO(text)))
+        if self.columns is None:
+            self.columns = [c.strip().lstrip("\ufeff") for c in row]
+            return None
+        return {k: v for k, v in zip(self.columns, row) if v != ""}
+
+
+def render_record(source_type: str, rec: dict) -> tuple[Optional[int], str, str]:
+    """Returns (source_id, title, content) for a tasting/brew record."""
+    sid = rec.get("source_id", rec.get("id"))
+    try:
+        source_id = int(sid) if sid not in (None, "") else None
+    except (TypeError, ValueError):
+        source_id = None
+    label = "Tasting" if source_type == "tasting" else "Brew"
+    bean = rec.get("bean_name") or rec.get("bean") or ""
+    title = rec.get("title") or f"{label}: {bean or source_id or '-'}"
+
+    parts = []
+    known = set()
+    for key, jp in _FIELD_LABELS[source_type]:
+        known.add(key)
+        v = rec.get(key)
+        if v in (None, "", []):
+            continue
+        if isinstance(v, list):
+            v = ", ".join(str(x) for x in v)
+        parts.append(f"{jp}: {v}")
+    for key, v in rec.items():
+        if key in known or key in _META_KEYS or v in (None, "", []):
+            continue
+        parts.append(f"{key}: {v}")
+    return source_id, title, "\n".join(parts).strip()
+
+
+class BulkImporter:
+    """Buffers records, embeds them in batches and writes with multi-row INSERTs."""
+
+    def __init__(self, source_type: str, batch_size: Optional[int] = None,
+                 embed_batch_size: Optional[int] = None, progress: Optional[Any] = None,
+                 start_offset: int = 0):
+        if source_type not in SOURCE_TYPES:
+            raise ValueError(f"unsupported source_type: {source_type}")
+        if not bedrock:
+            raise RuntimeError("LAMBDA_API_URL not configured")
+        self.source_type = source_type
+        self.batch_size = batch_size or settings.import_batch_size
+        self.embed_batch_size = embed_batch_size or settings.import_embed_batch_size
+        self.progress = progress
+        self.rows = 0
+        self.skipped = 0
+        self.docs = 0
+        self.chunks = 0
+        self.dedup_exact = 0
+        self.dedup_near = 0
+        self.next_offset = start_offset
+        self._batch: list[tuple[dict, int]] = []
+        self._started = time.monotonic()
+        self._conn: Optional[Any] = None
+
+    def add(self, rec: dict, end_offset: int) -> None:
+        self._batch.append((rec, end_offset))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        docs = []
+        for rec, _ in batch:
+            self.rows += 1
+            source_id, title, content = render_record(self.source_type, rec)
+            if not content:
+                self.skipped += 1
+                continue
+            docs.append((source_id, title, content))
+
+        if docs:
+            chunk_rows = []  # (doc position, chunk_index, content)
+            for pos, (_, _, content) in enumerate(docs):
+                for idx, c in enumerate(iter_chunks(content, 800)):
+                    chunk_rows.append((pos, idx, c))
+            self._write(docs, chunk_rows)
+
+        self.next_offset = batch[-1][1]
+        mark_primary_write()
+        if self.progress:
+            self.progress(self.stats())
+
+    def _embed_many(self, texts: list[str]) -> list[list[float]]:
+        out: list[list[float]] = []
+        for i in range(0, len(texts), self.embed_batch_size):
+            out.extend(bedrock.embed_batch(texts[i: i + self.embed_batch_size], priority=PRIORITY_BATCH))
+        return out
+
+    def _write(self, docs: list, chunk_rows: list) -> None:
+        # Own connection: the batch transaction must not capture other requests' writes
+        if self._conn is None:
+            self._conn = open_dedicated_conn()
+        conn = self._conn
+        # Hash lookups and embedding (with its retries/backoff) happen before the transaction;
+        # only the INSERTs run inside it. Only chunks not already stored are embedded.
+        texts = [c for _, _, c in chunk_rows]
+        plan = plan_chunks(conn, texts, self._embed_many)
+        # One transaction per batch so next_offset only advances past committed rows
+        with conn.transaction() if hasattr(conn, "transaction") else _Psycopg2Tx(conn):
+            with conn.cursor() as cur:
+                values = ", ".join(["(%s, %s, %s, %s)"] * len(docs))
+                params: list[Any] = []
+                for source_id, title, content in docs:
+                    params.extend([self.source_type, source_id, title, content])
+                cur.execute(
+                    f"""
+                    INSERT INTO documents (source_type, source_id, title, content)
+                    VALUES {values}
+                    RETURNING id
+                    """,
+                    params,
+                )
+                ids = [r[0] if not isinstance(r, dict) else r.get("id") for r in cur.fetchall()]
+            stats = write_chunks(conn, plan, texts, [(ids[pos], idx) for pos, idx, _ in chunk_rows])
+        self.docs += len(docs)
+        self.chunks += stats["chunks"]
+        self.dedup_exact += stats["dedup_exact"]
+        self.dedup_near += stats["dedup_near"]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            finally:
+                self._conn = None
+
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            "rows": self.rows,
+            "skipped": self.skipped,
+            "docs": self.docs,
+            "chunks": self.chunks,
+            "dedup_exact": self.dedup_exact,
+            "dedup_near": self.dedup_near,
+            "elapsed_sec": round(elapsed, 3),
+            "rows_per_sec": round(self.rows / elapsed, 2),
+            "next_offset": self.next_offset,
+        }
+
+
+class _Psycopg2Tx:
+    """Minimal transaction block for psycopg2 autocommit connections (the importer's own, never shared)."""
+
+    def __init__(self, conn: Any):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.autocommit = False
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.autocommit = True
+        return False
+
+
+def import_file(path: str, source_type: str, fmt: Optional[str] = None, offset: int = 0,
+                batch_size: Optional[int] = None, progress: Optional[Any] = None,
+                read_size: int = 1 << 16) -> dict:
+    fmt = fmt or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    columns = None
+    with open(path, "rb") as f:
+        if fmt == "csv" and offset > 0:
+            # Resuming mid-file: take column names from the header line
+            header = RecordParser("csv")
+            for _ in header.feed(f.readline()):
+                pass
+            columns = header.columns
+        f.seek(offset)
+        parser = RecordParser(fmt, start_offset=offset, columns=columns)
+        importer = BulkImporter(source_type, batch_size=batch_size, progress=progress,
+                                start_offset=offset)
+        try:
+            while True:
+                data = f.read(read_size)
+                if not data:
+                    break
+                for rec, end in parser.feed(data):
+                    importer.add(rec, end)
+            for rec, end in parser.finish():
+                importer.add(rec, end)
+            importer.flush()
+        finally:
+            importer.close()
+    return importer.stats()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Stream tasting/brew records into documents/chunks")
+    ap.add_argument("path")
+    ap.add_argument("--type", dest="source_type", choices=SOURCE_TYPES, required=True)
+    ap.add_argument("--format", dest="fmt", choices=FORMATS)
+    ap.add_argument("--offset", type=int, default=0, help="resume from this byte offset")
+    ap.add_argument("--batch-size", type=int, default=None)
+    args = ap.parse_args(argv)
+
+    def _progress(s: dict) -> None:
+        print(
+            f"rows={s['rows']} docs={s['docs']} chunks={s['chunks']} "
+            f"rows/s={s['rows_per_sec']} next_offset={s['next_offset']}",
+            file=sys.stderr,
+        )
+
+    stats = import_file(
+        args.path, args.source_type, fmt=args.fmt, offset=args.offset,
+        batch_size=args.batch_size, progress=_progress,
+    )
+    print(json.dumps(stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,134 @@
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import BackgroundTasks, FastAPI, Query, HTTPException, Request, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from .settings import settings
-from .db import get_conn, apply_schema
+from .db import (
+    get_conn,
+    apply_schema,
+    close_conn,
+    log_recommendation,
+    maintain_rec_logs,
+    mark_primary_write,
+    ping,
+    prepare_replicas,
+    prepare_statements,
+    replica_status,
+)
 from .bedrock_client import bedrock
-from .utils import chunk_text
-from .prompt import build_system_prompt, build_user_prompt
+from .resilience import PRIORITY_BATCH, CircuitOpenError
+from .utils import chunk_text, vector_literal
+from .prompt import build_system_prompt, build_user_blocks
+from .retrieval import retrieve
+from .dedup import collapse_shared, store_chunks
+from .tracing import tracer
+from .cache_warmer import lookup as cache_lookup, warm as warm_query_cache
+from .importer import FORMATS, SOURCE_TYPES, BulkImporter, RecordParser
 
 
-app = FastAPI(title="FastAPI RAG Coffee")
+logger = logging.getLogger(__name__)
+
+# Readiness state filled in by _warmup(); /ready returns 200 only once "ready" is True
+_warm_state: dict = {"ready": False, "error": None, "took_ms": None, "prepared": [], "bedrock": None}
+_stop = threading.Event()  # set on shutdown; ends the background loops
+
+
+def _prime_bedrock() -> None:
+    """One real embed + retrieval: opens the keep-alive connection, wakes the Lambda and
+    pulls chunks/documents pages into shared buffers. Best effort: a single attempt with
+    a short timeout (no retry loop), and a failure does not hold back readiness."""
+    if not bedrock or not settings.warmup_query:
+        return
+    try:
+        vec = bedrock.embed(settings.warmup_query, timeout=settings.warmup_timeout, retry=False)
+        retrieve(vector_literal(vec), 1)
+        _warm_state["bedrock"] = "ok"
+    except Exception as e:
+        _warm_state["bedrock"] = str(e)
+        logger.warning("bedrock warmup failed: %s", e)
+
+
+def _warmup() -> None:
+    """Opens the DB connection, PREPAREs hot statements and primes the Lambda connection."""
+    t0 = time.monotonic()
+    try:
+        get_conn()
+        _warm_state["prepared"] = prepare_statements()
+        prepare_replicas()
+    except Exception as e:
+        _warm_state["error"] = str(e)
+        logger.warning("warmup failed: %s", e)
+        return
+    _prime_bedrock()
+    _warm_state.update(ready=True, error=None, took_ms=round((time.monotonic() - t0) * 1000, 1))
+
+
+def _warmup_loop() -> None:
+    # Retry until the DB is reachable (e.g. it came up after the worker, or before /init-db)
+    while not _stop.is_set():
+        _warmup()
+        if _warm_state["ready"]:
+            return
+        _stop.wait(settings.warmup_retry_interval)
+
+
+def _maintenance_loop() -> None:
+    # rec_logs partitions must exist before their month starts, so this cannot rely on a cron
+    # job someone has to remember; it runs at startup and then on a timer in every worker
+    while not _stop.is_set():
+        try:
+            detached = maintain_rec_logs()
+            if detached:
+                logger.info("rec_logs maintenance detached %s", detached)
+            wait = settings.rec_logs_maintenance_hours * 3600
+        except Exception as e:
+            logger.warning("rec_logs maintenance failed: %s", e)
+            wait = max(settings.warmup_retry_interval, 60.0)
+        _stop.wait(wait)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Off the startup path: the app serves immediately and /ready reports progress
+    threading.Thread(target=_warmup_loop, name="warmup", daemon=True).start()
+    if settings.rec_logs_maintenance_hours > 0:
+        threading.Thread(target=_maintenance_loop, name="rec-logs-maintenance", daemon=True).start()
+    yield
+    _stop.set()
+    if bedrock:
+        bedrock.close()
+    close_conn()
+
+
+app = FastAPI(title="FastAPI RAG Coffee", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with tracer.span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path},
+    ) as sp:
+        response = await call_next(request)
+        sp.set("http.status_code", response.status_code)
+        response.headers["traceparent"] = sp.traceparent
+        return response
+
+
+def _embed_query(text: str) -> list[float]:
+    """Embeds a user query, mapping proxy failures to HTTP errors like generate does."""
+    try:
+        return bedrock.embed(text)
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
 
 
 class RecommendRequest(BaseModel):
@@ -19,7 +138,22 @@ class RecommendRequest(BaseModel):
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "lambda": bool(bedrock), "db": True}
+    return {
+        "status": "ok",
+        "lambda": bool(bedrock),
+        "db": ping(),
+        "replicas": replica_status(),
+        "bedrock_circuit": bedrock.breaker.state if bedrock else None,
+        "bedrock_concurrency": bedrock.limiter.limit if bedrock else None,
+    }
+
+
+@app.get("/ready")
+def ready(response: Response):
+    # Only reports; the warmup thread does (and retries) the work
+    if not _warm_state["ready"]:
+        response.status_code = 503
+    return {"ready": _warm_state["ready"], **{k: v for k, v in _warm_state.items() if k != "ready"}}
 
 
 @app.post("/init-db")
@@ -28,13 +162,18 @@ def init_db():
     return {"ok": True}
 
 
+@app.post("/maintenance/rec-logs")
+def rec_logs_maintenance():
+    return {"ok": True, "detached": maintain_rec_logs()}
+
+
 @app.post("/documents/build")
-def build_documents():
+def build_documents(background_tasks: BackgroundTasks):
     if not bedrock:
         return {"ok": False, "error": "LAMBDA_API_URL not configured"}
     conn = get_conn()
     created_docs = 0
-    created_chunks = 0
+    totals = {"chunks": 0, "dedup_exact": 0, "dedup_near": 0, "embedded": 0}
     with conn.cursor() as cur:
         cur.execute(
             """
@@ -81,69 +220,84 @@ def build_documents():
         created_docs += 1
 
         chunks = chunk_text(content, 800)
-        for idx, c in enumerate(chunks):
-            emb = bedrock.embed(c)
-            vector_str = "[" + ",".join(str(x) for x in emb) + "]"
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO chunks (doc_id, chunk_index, content, embedding)
-                    VALUES (%s, %s, %s, %s::vector)
-                    """,
-                    (doc_id, idx, c, vector_str),
-                )
-            created_chunks += 1
-
-    return {"ok": True, "docs": created_docs, "chunks": created_chunks}
+        # Duplicate chunks (identical bean descriptions etc.) are stored once and shared
+        stats = store_chunks(
+            conn,
+            [(doc_id, idx, c) for idx, c in enumerate(chunks)],
+            lambda texts: bedrock.embed_batch(texts, priority=PRIORITY_BATCH),
+        )
+        for key in totals:
+            totals[key] += stats[key]
+
+    # Replicas must replay up to here before serving retrieval (read-your-writes)
+    mark_primary_write()
+    # Re-mine rec_logs and refresh precomputed retrievals against the new chunks
+    if settings.query_cache_size > 0:
+        background_tasks.add_task(warm_query_cache)
+    return {"ok": True, "docs": created_docs, **totals}
+
+
+@app.post("/documents/import")
+async def import_documents(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    source_type: str = Query(..., alias="type"),
+    fmt: str = Query("jsonl", alias="format"),
+    offset: int = Query(0, ge=0),
+    columns: Optional[str] = Query(None),
+):
+    """Streams a JSONL/CSV request body (chunked upload OK) into documents/chunks.
+
+    The body is expected to start at byte `offset` of the source file. When
+    resuming a CSV past its header, pass the header as `columns=a,b,c`.
+    """
+    if not bedrock:
+        return {"ok": False, "error": "LAMBDA_API_URL not configured"}
+    if source_type not in SOURCE_TYPES:
+        raise HTTPException(status_code=400, detail=f"type must be one of {SOURCE_TYPES}")
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {FORMATS}")
+    cols = [c.strip() for c in columns.split(",")] if columns else None
+    if fmt == "csv" and offset > 0 and not cols:
+        raise HTTPException(status_code=400, detail="columns required when resuming CSV at offset > 0")
+
+    parser = RecordParser(fmt, start_offset=offset, columns=cols)
+    importer = BulkImporter(source_type, start_offset=offset)
+
+    def _add_all(recs) -> None:
+        for rec, end in recs:
+            importer.add(rec, end)
+
+    def _feed(data: bytes) -> None:
+        # Parsing is CPU-bound, so it runs in the threadpool with the inserts, off the event loop
+        _add_all(parser.feed(data))
+
+    try:
+        async for data in request.stream():
+            await run_in_threadpool(_feed, data)
+        await run_in_threadpool(_add_all, parser.finish())
+        await run_in_threadpool(importer.flush)
+    except Exception as e:
+        # Report how far we got so the client can resume from next_offset
+        return {"ok": False, "error": str(e), **importer.stats()}
+    finally:
+        await run_in_threadpool(importer.close)
+        # Committed batches change retrieval results, so refresh the hot-query cache as after a build
+        if importer.docs and settings.query_cache_size > 0:
+            background_tasks.add_task(warm_query_cache)
+    return {"ok": True, **importer.stats()}
 
 
 @app.get("/search")
 def search(query: str = Query(...), k: int = Query(10, ge=1, le=50)):
     if not bedrock:
         return {"ok": False, "error": "LAMBDA_API_URL not configured"}
-    qvec = bedrock.embed(query)
-    vstr = "[" + ",".join(str(x) for x in qvec) + "]"
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            WITH scored AS (
-              SELECT d.id AS doc_id,
-                     d.title,
-                     c.chunk_index,
-                     c.content,
-                     (c.embedding <=> %s::vector) AS distance,
-                     ROW_NUMBER() OVER (PARTITION BY d.id ORDER BY c.embedding <=> %s::vector) AS rn
-              FROM chunks c
-              JOIN documents d ON d.id = c.doc_id
-            )
-            SELECT doc_id, title, chunk_index, content, distance
-            FROM scored
-            WHERE rn = 1
-            ORDER BY distance
-            LIMIT %s
-            """,
-            (vstr, vstr, k),
-        )
-        rows = cur.fetchall()
-    results = []
-    for r in rows:
-        if isinstance(r, dict):
-            results.append({
-                "doc_id": r["doc_id"],
-                "title": r["title"],
-                "chunk_index": r["chunk_index"],
-                "distance": float(r["distance"]),
-                "content": r["content"],
-            })
-        else:
-            results.append({
-                "doc_id": r[0],
-                "title": r[1],
-                "chunk_index": r[2],
-                "distance": float(r[4]),
-                "content": r[3],
-            })
+    cached = cache_lookup(query)
+    if cached is not None:
+        return {"ok": True, "results": cached["results"][:k], "cached": True}
+    qvec = _embed_query(query)
+    vstr = vector_literal(qvec)
+    results = retrieve(vstr, k)
     return {"ok": True, "results": results}
 
 
@@ -156,75 +310,53 @@ def recommend(req: RecommendRequest):
         return {"ok": False, "error": "empty query"}
     top_k = min(max(req.top_k, 1), 32)
 
-    # 1) embed query and fetch neighbors
-    qvec = bedrock.embed(q)
-    vstr = "[" + ",".join(str(x) for x in qvec) + "]"
-    conn = get_conn()
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            WITH scored AS (
-              SELECT d.id AS doc_id,
-                     d.title,
-                     c.chunk_index,
-                     c.content,
-                     (c.embedding <=> %s::vector) AS distance,
-                     ROW_NUMBER() OVER (PARTITION BY d.id ORDER BY c.embedding <=> %s::vector) AS rn
-              FROM chunks c
-              JOIN documents d ON d.id = c.doc_id
-            )
-            SELECT doc_id, title, chunk_index, content, distance
-            FROM scored
-            WHERE rn = 1
-            ORDER BY distance
-            LIMIT %s
-            """,
-            (vstr, vstr, top_k),
-        )
-        rows = cur.fetchall()
+    # 1) embed query and fetch neighbors (hot queries are served from query_cache)
+    with tracer.span("cache.lookup") as sp:
+        cached = cache_lookup(q)
+        sp.set("cache.hit", cached is not None)
+    if cached is not None:
+        rows = cached["results"][:top_k]
+    else:
+        qvec = _embed_query(q)
+        vstr = vector_literal(qvec)
+        rows = retrieve(vstr, top_k)
 
-    contexts = []
-    for r in rows:
-        if isinstance(r, dict):
-            contexts.append({"title": r["title"], "content": r["content"]})
-        else:
-            contexts.append({"title": r[1], "content": r[3]})
+    # Documents sharing a deduplicated chunk become one context with all their titles
+    contexts = collapse_shared(rows)
 
     # 2) build prompt and generate
-    system = build_system_prompt()
-    user = build_user_prompt(q, contexts)
-    try:
-        answer = bedrock.generate(system, user, settings.max_tokens)
-    except Exception as e:
-        # Surface upstream error (Lambda/Bedrock) to client for easier debugging in PoC
-        raise HTTPException(status_code=502, detail=str(e))
+    if cached is not None and cached["answer"] is not None and cached["answer_top_k"] == top_k:
+        answer = cached["answer"]
+        model = "cache"
+        usage = None
+    else:
+        with tracer.span("prompt.build", contexts=len(contexts)) as sp:
+            system = build_system_prompt()
+            user = build_user_blocks(q, contexts)
+            sp.set("prompt.chars", len(system) + sum(len(b["text"]) for b in user))
+        try:
+            answer, usage = bedrock.generate_with_usage(system, user, settings.max_tokens)
+        except CircuitOpenError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            # Surface upstream error (Lambda/Bedrock) to client for easier debugging in PoC
+            raise HTTPException(status_code=502, detail=str(e))
+        model = "claude-bedrock"
 
     # 3) log minimal
-    candidates = []
-    for r in rows[: min(8, len(rows))]:
-        if isinstance(r, dict):
-            candidates.append({
-                "doc_id": r["doc_id"],
-                "chunk_index": r["chunk_index"],
-                "distance": float(r["distance"]),
-            })
-        else:
-            candidates.append({
-                "doc_id": r[0],
-                "chunk_index": r[2],
-                "distance": float(r[4]),
-            })
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-            INSERT INTO rec_logs (user_id, query_text, model, top_k, candidates, response_text)
-            VALUES (%s, %s, %s, %s, %s::jsonb, %s)
-            """,
-            (None, q, "claude-bedrock", top_k, __import__("json").dumps(candidates), answer),
-        )
+    candidates = [
+        {"doc_id": r["doc_id"], "chunk_index": r["chunk_index"], "distance": float(r["distance"])}
+        for r in rows[: min(8, len(rows))]
+    ]
+    log_recommendation(q, model, top_k, candidates, answer)
 
     # 返却する contexts は、プロンプトに渡した順序で全件返し、ref番号を付与
     contexts_with_ref = [
         {"ref": i + 1, **ctx} for i, ctx in enumerate(contexts)
     ]
-    return {"ok": True, "answer": answer, "contexts": contexts_with_ref, "candidates": candidates}
+    return {"ok": True, "answer": answer, "contexts": contexts_with_ref, "candidates": candidates, "usage": usage}
+
+
+@app.post("/cache/warm")
+def cache_warm(limit: Optional[int] = Query(None, ge=1, le=1000), answers: Optional[bool] = Query(None)):
+    return warm_query_cache(limit=limit, with_answers=answers)
@@ -1,6 +1,13 @@
 from typing import Sequence
 
 
+# Instruction part of the user turn; identical for every request so it belongs to the cached prefix
+INSTRUCTION_PREAMBLE = (
+    "次のコンテキストと条件に基づいて、条件に合うコーヒー豆を最大3件推薦してください。\n"
+    "各推薦は150文字以内で「理由」を書き、最後に参考ソース番号を括弧で示してください（例: (参考: #1,#3)）。"
+)
+
+
 def build_system_prompt() -> str:
     return (
         "あなたはプロのバリスタ兼キュレーターです。利用可能なデータ（豆情報、テイスティング、抽出設定）に基づき、"
@@ -8,17 +15,25 @@ def build_system_prompt() -> str:
     )
 
 
-def build_user_prompt(query: str, contexts: Sequence[dict]) -> str:
+def build_user_blocks(query: str, contexts: Sequence[dict]) -> list[dict]:
+    """User turn as text blocks ordered most-stable first: preamble, contexts, query.
+
+    `cache` marks the end of a reusable prefix (a prompt cache point). The
+    query varies per request, so it always comes last and is never cached.
+    """
     ctx = []
     for i, c in enumerate(contexts, 1):
         title = c.get("title")
         content = c.get("content", "")
         head = f"【#{i}{': ' + title if title else ''}】"
         ctx.append(f"{head}\n{content}")
-    joined = "\n\n".join(ctx)
-    return (
-        "次のコンテキストと条件に基づいて、条件に合うコーヒー豆を最大3件推薦してください。\n"
-        "各推薦は150文字以内で「理由」を書き、最後に参考ソース番号を括弧で示してください（例: (参考: #1,#3)）。\n"
-        f"\n[条件]\n{query}\n\n[コンテキスト]\n{joined}"
-    )
+    blocks = [{"text": INSTRUCTION_PREAMBLE, "cache": True}]
+    if ctx:
+        # Same retrieval (hot or repeated queries) -> same contexts -> reusable prefix
+        blocks.append({"text": "[コンテキスト]\n" + "\n\n".join(ctx), "cache": True})
+    blocks.append({"text": f"[条件]\n{query}"})
+    return blocks
 
+
+def build_user_prompt(query: str, contexts: Sequence[dict]) -> str:
+    return "\n\n".join(b["text"] for b in build_user_blocks(query, contexts))
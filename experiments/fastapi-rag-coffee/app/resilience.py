@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+
+PRIORITY_ONLINE = "online"
+PRIORITY_BATCH = "batch"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit breaker is open and calls are failing fast."""
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limiter shared by all Bedrock calls in this process.
+
+    The limit grows by `increase` after each success and is multiplied by
+    `decrease` on throttling / 5xx. Online callers are always admitted before
+    batch callers waiting on the same slot, so `/documents/build` only uses
+    capacity that `/search` and `/recommend` leave idle.
+    """
+
+    def __init__(self, initial: float, min_limit: float, max_limit: float,
+                 increase: float = 1.0, decrease: float = 0.5):
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self._limit = min(max(float(initial), self.min_limit), self.max_limit)
+        self._in_flight = 0
+        self._online_waiting = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _can_enter(self, priority: str) -> bool:
+        if self._in_flight >= self.limit:
+            return False
+        if priority == PRIORITY_BATCH and self._online_waiting:
+            return False
+        # Keep one slot free for online traffic while batch work is running
+        if priority == PRIORITY_BATCH and self.limit > 1 and self._in_flight >= self.limit - 1:
+            return False
+        return True
+
+    def acquire(self, priority: str = PRIORITY_ONLINE, timeout: float | None = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            online = priority != PRIORITY_BATCH
+            if online:
+                self._online_waiting += 1
+            try:
+                while not self._can_enter(PRIORITY_ONLINE if online else PRIORITY_BATCH):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._in_flight += 1
+                return True
+            finally:
+                if online:
+                    self._online_waiting -= 1
+
+    def release(self) -> None:
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._cond.notify_all()
+
+    def on_success(self) -> None:
+        with self._cond:
+            # Additive increase spread over the current window
+            self._limit = min(self.max_limit, self._limit + self.increase / max(self._limit, 1.0))
+            self._cond.notify_all()
+
+    def on_overload(self) -> None:
+        with self._cond:
+            self._limit = max(self.min_limit, self._limit * self.decrease)
+
+    @contextmanager
+    def slot(self, priority: str = PRIORITY_ONLINE, timeout: float | None = None) -> Iterator[None]:
+        if not self.acquire(priority, timeout):
+            raise RuntimeError(f"Bedrock concurrency slot not available within {timeout}s")
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class CircuitBreaker:
+    """Classic closed -> open -> half-open breaker.
+
+    Opens after `failure_threshold` consecutive overload failures and rejects
+    calls for `reset_timeout` seconds, then lets a single probe through.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("Bedrock circuit is open; failing fast")
+                self._state = self.HALF_OPEN
+            if self._probe_in_flight:
+                raise CircuitOpenError("Bedrock circuit is half-open; probe in flight")
+            self._probe_in_flight = True
+
+    def on_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def on_neutral(self) -> None:
+        """Non-overload outcome (e.g. 4xx validation error): release a half-open probe."""
+        with self._lock:
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._failures = 0
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: float | None = None) -> float:
+    """Full-jitter exponential backoff; honors an upstream Retry-After when larger."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
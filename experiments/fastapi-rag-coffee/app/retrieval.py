@@ -0,0 +1,74 @@
+from typing import Any, Optional
+
+from .db import execute_prepared, get_conn, get_read_conn, register_statement
+from .tracing import tracer
+
+
+# Best chunk per document (ROW_NUMBER rn=1), ordered by cosine distance.
+# Shared (deduplicated) chunks are expanded to every owner via chunk_owners.
+RETRIEVAL_SQL = """
+WITH scored AS (
+  SELECT d.id AS doc_id,
+         d.title,
+         o.chunk_index,
+         c.content,
+         (c.embedding <=> $1) AS distance,
+         c.id AS chunk_id,
+         ROW_NUMBER() OVER (PARTITION BY d.id ORDER BY c.embedding <=> $1) AS rn
+  FROM chunks c
+  JOIN chunk_owners o ON o.chunk_id = c.id
+  JOIN documents d ON d.id = o.doc_id
+)
+SELECT doc_id, title, chunk_index, content, distance, chunk_id
+FROM scored
+WHERE rn = 1
+ORDER BY distance
+LIMIT $2
+"""
+
+register_statement("rag_retrieve", "vector, integer", RETRIEVAL_SQL)
+
+
+def _row_to_dict(r: Any) -> dict:
+    # rows are tuples (psycopg3 default) or dicts (psycopg2 RealDictCursor)
+    if isinstance(r, dict):
+        return {
+            "doc_id": r["doc_id"],
+            "title": r["title"],
+            "chunk_index": r["chunk_index"],
+            "distance": float(r["distance"]),
+            "content": r["content"],
+            "chunk_id": r["chunk_id"],
+        }
+    return {
+        "doc_id": r[0],
+        "title": r[1],
+        "chunk_index": r[2],
+        "distance": float(r[4]),
+        "content": r[3],
+        "chunk_id": r[5],
+    }
+
+
+def retrieve(vstr: str, k: int, conn: Optional[Any] = None) -> list[dict]:
+    """Runs the nearest-neighbour CTE for a pgvector literal and returns dict rows.
+
+    Without an explicit `conn` the query goes to a read replica when configured.
+    """
+    with tracer.span("sql.retrieve", k=k) as sp:
+        if conn is not None:
+            rows = execute_prepared("rag_retrieve", (vstr, k), conn)
+            return [_row_to_dict(r) for r in rows]
+        # Read-only: route to a replica, falling back to the primary if it fails mid-query
+        rc = get_read_conn()
+        primary = get_conn()
+        sp.set("db.replica", rc is not primary)
+        try:
+            rows = execute_prepared("rag_retrieve", (vstr, k), rc)
+        except Exception:
+            if rc is primary:
+                raise
+            sp.set("db.replica_fallback", True)
+            rows = execute_prepared("rag_retrieve", (vstr, k), primary)
+        sp.set("db.rows", len(rows))
+        return [_row_to_dict(r) for r in rows]
@@ -10,11 +10,62 @@ class Settings:
     db_name: str = os.getenv("DB_NAME", "coffee_rag")
     db_user: str = os.getenv("DB_USER", "postgres")
     db_password: str = os.getenv("DB_PASSWORD", "postgres")
+    db_connect_timeout: int = int(os.getenv("DB_CONNECT_TIMEOUT", "5"))
+    # Read replicas for retrieval queries: libpq DSNs separated by ";"
+    db_replica_dsns: list[str] = [d.strip() for d in os.getenv("DB_REPLICA_DSNS", "").split(";") if d.strip()]
+    db_replica_strategy: str = os.getenv("DB_REPLICA_STRATEGY", "round_robin")  # round_robin|least_latency
+    db_replica_health_interval: float = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "10"))
+    db_read_your_writes: bool = os.getenv("DB_READ_YOUR_WRITES", "true").lower() in ("1", "true", "yes")
 
     lambda_api_url: str = os.getenv("LAMBDA_API_URL", "").rstrip("/")
     embedding_dim: int = int(os.getenv("EMBEDDING_DIM", "1024"))
     max_tokens: int = int(os.getenv("MAX_TOKENS", "800"))
+    # Bedrock prompt caching: cache points after the system prompt, preamble and contexts
+    prompt_cache: bool = os.getenv("PROMPT_CACHE", "true").lower() in ("1", "true", "yes")
 
+    # Bedrock call resilience (adaptive concurrency / retry / circuit breaker)
+    bedrock_concurrency_initial: int = int(os.getenv("BEDROCK_CONCURRENCY_INITIAL", "4"))
+    bedrock_concurrency_min: int = int(os.getenv("BEDROCK_CONCURRENCY_MIN", "1"))
+    bedrock_concurrency_max: int = int(os.getenv("BEDROCK_CONCURRENCY_MAX", "16"))
+    bedrock_max_retries: int = int(os.getenv("BEDROCK_MAX_RETRIES", "4"))
+    bedrock_backoff_base: float = float(os.getenv("BEDROCK_BACKOFF_BASE", "0.5"))
+    bedrock_backoff_cap: float = float(os.getenv("BEDROCK_BACKOFF_CAP", "20"))
+    bedrock_breaker_threshold: int = int(os.getenv("BEDROCK_BREAKER_THRESHOLD", "5"))
+    bedrock_breaker_reset: float = float(os.getenv("BEDROCK_BREAKER_RESET", "30"))
 
-settings = Settings()
+    # Streaming bulk import (tasting/brew)
+    import_batch_size: int = int(os.getenv("IMPORT_BATCH_SIZE", "64"))
+    import_embed_batch_size: int = int(os.getenv("IMPORT_EMBED_BATCH_SIZE", "16"))
+
+    # Near-duplicate chunk collapsing: max cosine distance (0 = exact hash dedup only).
+    # Opt-in: lossy (the document is served with the matched chunk's text) and one
+    # unindexed nearest-neighbour scan of `chunks` per new chunk.
+    dedup_near_distance: float = float(os.getenv("DEDUP_NEAR_DISTANCE", "0"))
+
+    # Hot-query cache mined from rec_logs (0 disables lookup)
+    query_cache_size: int = int(os.getenv("QUERY_CACHE_SIZE", "100"))
+    query_cache_lookback_days: int = int(os.getenv("QUERY_CACHE_LOOKBACK_DAYS", "30"))
+    query_cache_answers: bool = os.getenv("QUERY_CACHE_ANSWERS", "false").lower() in ("1", "true", "yes")
+
+    # rec_logs monthly partitions (retention 0 keeps everything)
+    rec_logs_partitions_ahead: int = int(os.getenv("REC_LOGS_PARTITIONS_AHEAD", "3"))
+    rec_logs_retention_months: int = int(os.getenv("REC_LOGS_RETENTION_MONTHS", "6"))
+    rec_logs_drop_detached: bool = os.getenv("REC_LOGS_DROP_DETACHED", "true").lower() in ("1", "true", "yes")
+    # In-app maintenance timer (partitions ahead + retention); 0 disables it (use cron instead)
+    rec_logs_maintenance_hours: float = float(os.getenv("REC_LOGS_MAINTENANCE_HOURS", "24"))
 
+    # Startup warmup: embedded once to prime the Lambda connection and retrieval plan (empty skips Bedrock)
+    warmup_query: str = os.getenv("WARMUP_QUERY", "コーヒー")
+    # Single-attempt timeout for that embed, and the delay between background warmup retries
+    warmup_timeout: float = float(os.getenv("WARMUP_TIMEOUT", "10"))
+    warmup_retry_interval: float = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+    # Tracing: none|file|otlp; sampled share of root requests
+    trace_exporter: str = os.getenv("TRACE_EXPORTER", "none").lower()
+    trace_otlp_endpoint: str = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    trace_file: str = os.getenv("TRACE_FILE", "traces.jsonl")
+    trace_sample_ratio: float = float(os.getenv("TRACE_SAMPLE_RATIO", "0.05"))
+    trace_service_name: str = os.getenv("TRACE_SERVICE_NAME", "fastapi-rag-coffee")
+
+
+settings = Settings()
@@ -0,0 +1,201 @@
+"""Minimal OpenTelemetry-compatible tracing (no SDK dependency).
+
+Spans carry W3C trace context (`traceparent`) so a trace started here is
+continued by the Lambda proxy. Finished spans are exported in OTLP/JSON
+shape either to a collector (`TRACE_EXPORTER=otlp`, e.g.
+http://localhost:4318/v1/traces) or as JSON lines to a file
+(`TRACE_EXPORTER=file`). Root spans are sampled with `TRACE_SAMPLE_RATIO`;
+unsampled traces only propagate context and cost a few attribute writes.
+"""
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+import httpx
+
+from .settings import settings
+
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start_ns", "end_ns",
+                 "attributes", "status_error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: dict[str, Any] = {}
+        self.status_error: Optional[str] = None
+
+    def set(self, key: str, value: Any) -> None:
+        if self.sampled:
+            self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_otlp(self) -> dict:
+        def _val(v: Any) -> dict:
+            if isinstance(v, bool):
+                return {"boolValue": v}
+            if isinstance(v, int):
+                return {"intValue": str(v)}
+            if isinstance(v, float):
+                return {"doubleValue": v}
+            return {"stringValue": str(v)}
+
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _val(v)} for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.status_error} if self.status_error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple[str, str, bool]]:
+    """Returns (trace_id, parent_span_id, sampled) from a W3C traceparent header."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class _Exporter:
+    """Batches finished spans on a background thread."""
+
+    def __init__(self, kind: str, target: str, service: str):
+        self.kind = kind
+        self.target = target
+        self.service = service
+        self._q: "queue.Queue[Span]" = queue.Queue(maxsize=10000)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, span: Span) -> None:
+        try:
+            self._q.put_nowait(span)
+        except queue.Full:
+            pass  # drop rather than block the request path
+
+    def _drain(self, first: Optional[Span] = None) -> list[Span]:
+        batch = [first] if first else []
+        while len(batch) < 512:
+            try:
+                batch.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self._export(self._drain(first))
+
+    def flush(self) -> None:
+        batch = self._drain()
+        if batch:
+            self._export(batch)
+
+    def _export(self, spans: list[Span]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service}},
+                ]},
+                "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+            }]
+        }
+        try:
+            if self.kind == "otlp":
+                httpx.post(self.target, json=body, timeout=5)
+            else:
+                with open(self.target, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(body, ensure_ascii=False) + "\n")
+        except Exception:
+            pass  # tracing must never break the app
+
+
+class Tracer:
+    def __init__(self, exporter: Optional[_Exporter], sample_ratio: float):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+
+    @contextmanager
+    def span(self, name: str, traceparent: Optional[str] = None, **attrs: Any) -> Iterator[Span]:
+        """Starts a child of the current span, or a root (continuing `traceparent` if given)."""
+        parent = _current.get()
+        remote = parse_traceparent(traceparent) if parent is None else None
+        if parent is not None:
+            sp = Span(name, parent.trace_id, parent.span_id, parent.sampled)
+        elif remote is not None:
+            sp = Span(name, remote[0], remote[1], remote[2])
+        else:
+            sampled = self.exporter is not None and random.random() < self.sample_ratio
+            sp = Span(name, f"{random.getrandbits(128):032x}", None, sampled)
+        for k, v in attrs.items():
+            sp.set(k, v)
+        token = _current.set(sp)
+        try:
+            yield sp
+        except BaseException as e:
+            if sp.sampled:
+                sp.status_error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            _current.reset(token)
+            sp.end_ns = time.time_ns()
+            if sp.sampled and self.exporter is not None:
+                self.exporter.submit(sp)
+
+
+def current_traceparent() -> Optional[str]:
+    sp = _current.get()
+    return sp.traceparent if sp is not None else None
+
+
+def _make_tracer() -> Tracer:
+    kind = settings.trace_exporter
+    exporter = None
+    if kind == "otlp":
+        exporter = _Exporter("otlp", settings.trace_otlp_endpoint, settings.trace_service_name)
+    elif kind == "file":
+        exporter = _Exporter("file", os.path.abspath(settings.trace_file), settings.trace_service_name)
+    return Tracer(exporter, settings.trace_sample_ratio)
+
+
+tracer = _make_tracer()
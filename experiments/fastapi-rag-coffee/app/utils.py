@@ -1,8 +1,14 @@
-def chunk_text(text: str, max_chars: int = 800) -> list[str]:
+from typing import Iterator, Sequence
+
+
+def iter_chunks(text: str, max_chars: int = 800) -> Iterator[str]:
+    """Generator version of chunk_text(); yields chunks without building a list."""
     clean = " ".join(text.split()).strip()
+    if not clean:
+        return
     if len(clean) <= max_chars:
-        return [clean] if clean else []
-    out: list[str] = []
+        yield clean
+        return
     i = 0
     n = len(clean)
     while i < n:
@@ -13,7 +19,21 @@ def chunk_text(text: str, max_chars: int = 800) -> list[str]:
         if p == -1:
             p = slice_.rfind(".")
         break_idx = window_start + p + 1 if p != -1 else end
-        out.append(clean[i:break_idx].strip())
+        chunk = clean[i:break_idx].strip()
+        if chunk:
+            yield chunk
         i = break_idx
-    return [c for c in out if c]
 
+
+def chunk_text(text: str, max_chars: int = 800) -> list[str]:
+    return list(iter_chunks(text, max_chars))
+
+
+def vector_literal(vec: Sequence[float]) -> str:
+    """Format an embedding as a pgvector text literal ('[x,y,...]')."""
+    return "[" + ",".join(str(x) for x in vec) + "]"
+
+
+def normalize_query(q: str) -> str:
+    """Lowercase + collapse whitespace (incl. U+3000); the query_cache / rec_logs.norm_query key."""
+    return " ".join((q or "").split()).lower()
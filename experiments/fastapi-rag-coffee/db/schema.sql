@@ -35,7 +35,7 @@ CREATE TABLE IF NOT EXISTS documents (
 -- 既定: 1536 次元（.envのEMBEDDING_DIMと合わせること）
 CREATE TABLE IF NOT EXISTS chunks (
   id            BIGSERIAL PRIMARY KEY,
-  doc_id        BIGINT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+  doc_id        BIGINT REFERENCES documents(id) ON DELETE SET NULL, -- 最初の所有者（参考情報。所有関係は chunk_owners）
   chunk_index   INTEGER NOT NULL,
   content       TEXT NOT NULL,
   embedding     vector(1536) NOT NULL
@@ -43,15 +43,212 @@ CREATE TABLE IF NOT EXISTS chunks (
 
 CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (doc_id);
 
--- Recommendation logs (簡易)
+-- 重複チャンクの共有（app/dedup.py）: 内容ハッシュで完全一致を検出し、
+-- 同一/近似チャンクは1行だけ保存して chunk_owners で所有ドキュメントに対応付ける
+ALTER TABLE chunks ADD COLUMN IF NOT EXISTS content_hash TEXT;
+UPDATE chunks SET content_hash = md5(content) WHERE content_hash IS NULL;
+CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks (content_hash);
+
+CREATE TABLE IF NOT EXISTS chunk_owners (
+  chunk_id      BIGINT NOT NULL REFERENCES chunks(id) ON DELETE CASCADE,
+  doc_id        BIGINT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+  chunk_index   INTEGER NOT NULL,
+  PRIMARY KEY (chunk_id, doc_id)
+);
+CREATE INDEX IF NOT EXISTS idx_chunk_owners_doc ON chunk_owners (doc_id);
+
+-- 既存チャンクは自身の doc_id を所有者として登録
+INSERT INTO chunk_owners (chunk_id, doc_id, chunk_index)
+SELECT c.id, c.doc_id, c.chunk_index
+FROM chunks c
+WHERE c.doc_id IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM chunk_owners o WHERE o.chunk_id = c.id AND o.doc_id = c.doc_id);
+
+-- 共有チャンクは最初に保存したドキュメントの削除で消えてはいけない:
+-- chunks.doc_id の CASCADE を SET NULL に変更し、削除は chunk_owners が空になったときだけ行う
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'chunks'::regclass AND contype = 'f' AND confdeltype = 'c'
+      AND confrelid = 'documents'::regclass
+  ) THEN
+    ALTER TABLE chunks DROP CONSTRAINT chunks_doc_id_fkey;
+    ALTER TABLE chunks ALTER COLUMN doc_id DROP NOT NULL;
+    ALTER TABLE chunks ADD CONSTRAINT chunks_doc_id_fkey
+      FOREIGN KEY (doc_id) REFERENCES documents(id) ON DELETE SET NULL;
+  END IF;
+END $$;
+
+-- 所有者がいなくなったチャンクを回収（ドキュメント削除 → chunk_owners の CASCADE 経由で発火）
+CREATE OR REPLACE FUNCTION chunks_gc_orphans() RETURNS TRIGGER AS $$
+BEGIN
+  DELETE FROM chunks c
+  WHERE c.id IN (SELECT DISTINCT chunk_id FROM gone)
+    AND NOT EXISTS (SELECT 1 FROM chunk_owners o WHERE o.chunk_id = c.id);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chunk_owners_gc ON chunk_owners;
+CREATE TRIGGER trg_chunk_owners_gc
+  AFTER DELETE ON chunk_owners
+  REFERENCING OLD TABLE AS gone
+  FOR EACH STATEMENT EXECUTE FUNCTION chunks_gc_orphans();
+
+-- 旧版の CASCADE で取り残された孤立チャンクも回収
+DELETE FROM chunks c WHERE NOT EXISTS (SELECT 1 FROM chunk_owners o WHERE o.chunk_id = c.id);
+
+-- Recommendation logs: created_at で月次パーティション分割
+-- 旧版の非パーティションテーブルがあれば rec_logs_legacy に退避し、下で移行する
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relname = 'rec_logs' AND n.nspname = current_schema() AND c.relkind = 'r'
+  ) THEN
+    ALTER TABLE rec_logs RENAME TO rec_logs_legacy;
+  END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS rec_logs (
-  id             BIGSERIAL PRIMARY KEY,
+  id             BIGSERIAL,
   user_id        TEXT,
   query_text     TEXT,
   model          TEXT,
   top_k          INTEGER,
   candidates     JSONB,
   response_text  TEXT,
-  created_at     TIMESTAMPTZ DEFAULT now()
+  created_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+  norm_query     TEXT,
+  PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+-- 正規化済みクエリ（app/utils.py normalize_query で INSERT 時に計算。query_cache のキーと一致）
+ALTER TABLE rec_logs ADD COLUMN IF NOT EXISTS norm_query TEXT;
+
+-- 範囲外の行を受け止める保険（通常は空のまま）
+CREATE TABLE IF NOT EXISTS rec_logs_default PARTITION OF rec_logs DEFAULT;
+
+-- 時系列の範囲スキャン用（追記順と相関するため BRIN で十分小さい）
+CREATE INDEX IF NOT EXISTS idx_rec_logs_created_brin ON rec_logs USING brin (created_at);
+-- 正規化クエリでの集計用（旧版の式インデックスは SQL 側の正規化が Python と一致しないため廃止）
+DROP INDEX IF EXISTS idx_rec_logs_norm_query;
+CREATE INDEX IF NOT EXISTS idx_rec_logs_norm_key ON rec_logs (norm_query);
+
+-- 月次パーティション rec_logs_pYYYYMM を作成（既存なら何もしない）
+-- メンテナンスが止まっていてその月の行が DEFAULT に入っている場合、そのままでは作成できないため
+-- DEFAULT を DETACH → パーティション作成 → 該当行を移動 → 再 ATTACH する（関数内なので1トランザクション）
+CREATE OR REPLACE FUNCTION rec_logs_create_partition(p_month DATE) RETURNS VOID AS $$
+DECLARE
+  m_start DATE := date_trunc('month', p_month)::date;
+  m_end   DATE := (date_trunc('month', p_month) + INTERVAL '1 month')::date;
+  m_name  TEXT := format('rec_logs_p%s', to_char(m_start, 'YYYYMM'));
+  stray   BOOLEAN := FALSE;
+BEGIN
+  IF to_regclass(m_name) IS NOT NULL THEN
+    RETURN;
+  END IF;
+  IF to_regclass('rec_logs_default') IS NOT NULL THEN
+    SELECT EXISTS (
+      SELECT 1 FROM rec_logs_default WHERE created_at >= m_start AND created_at < m_end
+    ) INTO stray;
+  END IF;
+  IF stray THEN
+    ALTER TABLE rec_logs DETACH PARTITION rec_logs_default;
+  END IF;
+  EXECUTE format(
+    'CREATE TABLE %I PARTITION OF rec_logs FOR VALUES FROM (%L) TO (%L)',
+    m_name, m_start, m_end
+  );
+  IF stray THEN
+    WITH moved AS (
+      DELETE FROM rec_logs_default
+      WHERE created_at >= m_start AND created_at < m_end
+      RETURNING id, user_id, query_text, model, top_k, candidates, response_text, created_at, norm_query
+    )
+    INSERT INTO rec_logs (id, user_id, query_text, model, top_k, candidates, response_text, created_at, norm_query)
+    SELECT * FROM moved;
+    ALTER TABLE rec_logs ATTACH PARTITION rec_logs_default DEFAULT;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- p_from の月から、当月 + p_months_ahead か月先までのパーティションを用意
+CREATE OR REPLACE FUNCTION rec_logs_ensure_partitions(p_from DATE, p_months_ahead INTEGER) RETURNS VOID AS $$
+DECLARE
+  m DATE := date_trunc('month', LEAST(p_from, now()::date))::date;
+  last_m DATE := (date_trunc('month', now()) + make_interval(months => p_months_ahead))::date;
+BEGIN
+  WHILE m <= last_m LOOP
+    PERFORM rec_logs_create_partition(m);
+    m := (m + INTERVAL '1 month')::date;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 当月を含め p_keep_months か月より古いパーティションを DETACH（p_drop なら DROP も）
+CREATE OR REPLACE FUNCTION rec_logs_apply_retention(p_keep_months INTEGER, p_drop BOOLEAN DEFAULT TRUE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+  cutoff DATE := (date_trunc('month', now()) - make_interval(months => p_keep_months - 1))::date;
+  part RECORD;
+BEGIN
+  IF p_keep_months <= 0 THEN
+    RETURN;
+  END IF;
+  FOR part IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'rec_logs'::regclass
+      AND c.relname ~ '^rec_logs_p[0-9]{6}$'
+      AND to_date(substring(c.relname FROM 11), 'YYYYMM') < cutoff
+    ORDER BY c.relname
+  LOOP
+    EXECUTE format('ALTER TABLE rec_logs DETACH PARTITION %I', part.relname);
+    IF p_drop THEN
+      EXECUTE format('DROP TABLE %I', part.relname);
+    END IF;
+    RETURN NEXT part.relname;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 旧テーブルからの移行
+DO $$
+DECLARE
+  min_at TIMESTAMPTZ;
+BEGIN
+  IF to_regclass('rec_logs_legacy') IS NOT NULL THEN
+    SELECT min(created_at) INTO min_at FROM rec_logs_legacy;
+    PERFORM rec_logs_ensure_partitions(COALESCE(min_at, now())::date, 3);
+    INSERT INTO rec_logs (id, user_id, query_text, model, top_k, candidates, response_text, created_at)
+    SELECT id, user_id, query_text, model, top_k, candidates, response_text, COALESCE(created_at, now())
+    FROM rec_logs_legacy;
+    PERFORM setval(pg_get_serial_sequence('rec_logs', 'id'),
+                   COALESCE((SELECT max(id) FROM rec_logs), 1),
+                   (SELECT max(id) IS NOT NULL FROM rec_logs));
+    DROP TABLE rec_logs_legacy;
+  END IF;
+END $$;
+
+
+-- Hot-query cache (app/cache_warmer.py): precomputed embeddings / retrievals / answers
+-- embedding は次元を固定しない（EMBEDDING_DIM に追従）
+CREATE TABLE IF NOT EXISTS query_cache (
+  norm_query     TEXT PRIMARY KEY,
+  query_text     TEXT NOT NULL,
+  embedding      vector NOT NULL,
+  results        JSONB NOT NULL,
+  answer_top_k   INTEGER,
+  answer         TEXT,
+  hits           BIGINT NOT NULL DEFAULT 0,
+  built_at       TIMESTAMPTZ DEFAULT now()
 );
 
+-- Read-your-writes floor shared by all app workers (app/db.py mark_primary_write)
+-- ビルド/取込を実行したワーカー以外も、この LSN まで再生済みのレプリカだけを使う
+CREATE TABLE IF NOT EXISTS replica_read_floor (
+  id   BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+  lsn  PG_LSN NOT NULL
+);
@@ -5,6 +5,14 @@ locals {
     # Use try() to allow null -> empty string without coalesce error
     GENERATION_INFERENCE_PROFILE_ARN = try(var.bedrock_generation_inference_profile_arn, "")
     EMBEDDING_INFERENCE_PROFILE_ARN  = try(var.bedrock_embedding_inference_profile_arn, "")
+    # Tracing: continue caller-sampled traces; export to CloudWatch (stdout) or an OTLP endpoint
+    TRACE_EXPORTER      = var.lambda_trace_exporter
+    TRACE_OTLP_ENDPOINT = var.lambda_trace_otlp_endpoint
+    TRACE_SAMPLE_RATIO  = var.lambda_trace_sample_ratio
+    # Optional multi-region / multi-profile pools (JSON lists) and hedge delay
+    BEDROCK_TARGETS_GENERATE = jsonencode(var.bedrock_generation_targets)
+    BEDROCK_TARGETS_EMBED    = jsonencode(var.bedrock_embedding_targets)
+    HEDGE_AFTER_MS           = var.bedrock_hedge_after_ms
   }
 }
 
@@ -1,9 +1,135 @@
 import json
 import os
 import base64
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+# Module import time marks the start of a cold start
+_INIT_START_NS = time.time_ns()
+_COLD_START = True
+
+
+# ---- Tracing: continues the caller's W3C traceparent and exports OTLP/JSON ----
+# TRACE_EXPORTER=stdout (CloudWatch, default) | otlp (POST to TRACE_OTLP_ENDPOINT) | none
+class _Trace:
+    def __init__(self, traceparent: str | None):
+        self.spans: list[dict] = []
+        # Per-thread span stack so hedged Bedrock calls nest under the right parent
+        self._local = threading.local()
+        self.trace_id = None
+        self.parent_id = None
+        self.sampled = False
+        parts = (traceparent or '').strip().split('-')
+        if len(parts) >= 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+            try:
+                self.sampled = bool(int(parts[3][:2], 16) & 1)
+                self.trace_id, self.parent_id = parts[1], parts[2]
+            except ValueError:
+                pass
+        if self.trace_id is None:
+            ratio = float(os.environ.get('TRACE_SAMPLE_RATIO') or 0)
+            self.trace_id = f"{random.getrandbits(128):032x}"
+            self.sampled = random.random() < ratio
+        if (os.environ.get('TRACE_EXPORTER') or 'stdout').lower() == 'none':
+            self.sampled = False
+
+    @property
+    def stack(self) -> list[dict]:
+        st = getattr(self._local, 'stack', None)
+        if st is None:
+            st = self._local.stack = []
+        return st
+
+    def adopt(self, parent: dict | None) -> None:
+        """Makes `parent` the current span in a worker thread."""
+        self._local.stack = [parent] if parent else []
+
+    def current(self) -> dict | None:
+        return self.stack[-1] if self.stack else None
+
+    def start(self, name: str, start_ns: int | None = None, **attrs) -> dict:
+        parent = self.stack[-1]['spanId'] if self.stack else self.parent_id
+        span = {
+            'traceId': self.trace_id,
+            'spanId': f"{random.getrandbits(64):016x}",
+            'name': name,
+            'kind': 2,
+            'startTimeUnixNano': str(start_ns or time.time_ns()),
+            'attributes': dict(attrs),
+        }
+        if parent:
+            span['parentSpanId'] = parent
+        self.stack.append(span)
+        return span
+
+    def end(self, span: dict, error: Exception | None = None) -> None:
+        span['endTimeUnixNano'] = str(time.time_ns())
+        span['status'] = {'code': 2, 'message': str(error)[:300]} if error else {'code': 1}
+        if self.stack and self.stack[-1] is span:
+            self.stack.pop()
+        self.spans.append(span)
+
+    def span(self, name: str, **attrs):
+        trace = self
+
+        class _Ctx:
+            def __enter__(self):
+                self.s = trace.start(name, **attrs)
+                return self.s['attributes']
+
+            def __exit__(self, exc_type, exc, tb):
+                trace.end(self.s, exc)
+                return False
+
+        return _Ctx()
+
+    def export(self) -> None:
+        if not self.sampled or not self.spans:
+            return
+
+        def _val(v):
+            if isinstance(v, bool):
+                return {'boolValue': v}
+            if isinstance(v, int):
+                return {'intValue': str(v)}
+            return {'stringValue': str(v)}
+
+        for sp in self.spans:
+            sp['attributes'] = [{'key': k, 'value': _val(v)} for k, v in sp['attributes'].items() if v is not None]
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': 'bedrock-proxy'}}]},
+            'scopeSpans': [{'scope': {'name': 'bedrock_proxy'}, 'spans': self.spans}],
+        }]}
+        try:
+            if (os.environ.get('TRACE_EXPORTER') or 'stdout').lower() == 'otlp':
+                req = urllib.request.Request(
+                    os.environ.get('TRACE_OTLP_ENDPOINT') or 'http://localhost:4318/v1/traces',
+                    data=json.dumps(body).encode('utf-8'),
+                    headers={'content-type': 'application/json'},
+                    method='POST',
+                )
+                urllib.request.urlopen(req, timeout=2).read()
+            else:
+                print('otlp_trace:', json.dumps(body, ensure_ascii=False))
+        except Exception as e:
+            print('trace export failed:', e)
+
+
+class _NoTrace(_Trace):
+    def __init__(self):
+        super().__init__(None)
+        self.sampled = False
+
+
+# Active trace for the current invocation (Lambda runs one event at a time per container)
+_trace: _Trace = _NoTrace()
+
 
 def _arn_region(arn: str | None) -> str | None:
     """Extract region from an ARN (arn:partition:service:region:account:resource)."""
@@ -46,7 +172,12 @@ def _invoke_bedrock(bedrock, *, body_bytes: bytes, model_id: str | None, inferen
     else:
         kwargs['modelId'] = model_id
 
-    return bedrock.invoke_model(**kwargs)
+    with _trace.span('bedrock.invoke_model',
+                     **{'bedrock.model_id': kwargs.get('modelId'),
+                        'bedrock.inference_profile': kwargs.get('inferenceProfileArn') or (
+                            inference_profile_arn if inference_profile_arn else None),
+                        'cloud.region': bedrock.meta.region_name}):
+        return bedrock.invoke_model(**kwargs)
 
 
 def _find_inference_profile_for_model(bedrock_ctl, model_id: str | None) -> str | None:
@@ -119,6 +250,256 @@ def _invoke_with_auto_profile(bedrock, bedrock_ctl, *, body_bytes: bytes, model_
         raise
 
 
+# ---- Multi-region / multi-profile routing ----
+# BEDROCK_TARGETS_GENERATE / BEDROCK_TARGETS_EMBED hold a JSON list like
+#   [{"region": "us-east-1", "modelId": "...", "inferenceProfileArn": null, "weight": 2,
+#     "endpointUrl": "http://localhost:9001"}]
+# Each call goes to the best target by (EWMA latency / weight), skipping throttled ones;
+# if it has not answered after HEDGE_AFTER_MS a second target is raced against it.
+
+_THROTTLE_CODES = {'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException',
+                   'ModelNotReadyException'}
+# Errors worth trying the next target for; anything else (bad input, access) fails fast
+_FAILOVER_CODES = _THROTTLE_CODES | {'InternalServerException', 'ModelTimeoutException'}
+_clients: dict[tuple, tuple] = {}
+# No SDK retries on routed calls: a throttle must reach _Router at once so it can mark the
+# target and fail over / hedge, instead of botocore backing off against the same target
+_ROUTED_CONFIG = Config(retries={'max_attempts': 1, 'mode': 'standard'})
+_clients_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=8)
+# Fan-out for batch embeds (`texts`); separate pool so its workers never wait on their own routed calls
+_EMBED_BATCH_MAX = int(os.environ.get('EMBED_BATCH_MAX') or 64)
+_embed_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('EMBED_BATCH_CONCURRENCY') or 4))
+
+
+def _clients_for(region: str | None, endpoint_url: str | None):
+    """Cached (runtime, control) clients; reused across warm invocations."""
+    key = (region, endpoint_url)
+    with _clients_lock:
+        if key not in _clients:
+            kw = {'region_name': region, 'config': _ROUTED_CONFIG}
+            if endpoint_url:
+                kw['endpoint_url'] = endpoint_url
+            _clients[key] = (boto3.client('bedrock-runtime', **kw), boto3.client('bedrock', **kw))
+        return _clients[key]
+
+
+class _Target:
+    def __init__(self, spec: dict):
+        self.region = spec.get('region')
+        self.model_id = spec.get('modelId')
+        self.inference_profile_arn = spec.get('inferenceProfileArn')
+        self.endpoint_url = spec.get('endpointUrl')
+        self.weight = float(spec.get('weight') or 1.0)
+        self.key = (self.region, self.model_id, self.inference_profile_arn, self.endpoint_url)
+
+
+class _TargetStats:
+    def __init__(self):
+        self.ewma_ms: float | None = None
+        self.throttled_until = 0.0
+        self.consecutive_throttles = 0
+        self.in_flight = 0
+
+
+class _Router:
+    def __init__(self):
+        self._stats: dict[tuple, _TargetStats] = {}
+        self._lock = threading.Lock()
+
+    def _st(self, t: _Target) -> _TargetStats:
+        with self._lock:
+            return self._stats.setdefault(t.key, _TargetStats())
+
+    def _score(self, t: _Target, now: float) -> float:
+        st = self._st(t)
+        penalty = 1e9 if now < st.throttled_until else 0.0
+        # Unknown latency scores 0 so every target gets explored once
+        base = (st.ewma_ms or 0.0) * (1 + st.in_flight)
+        return penalty + base / t.weight + random.random()  # jitter breaks ties
+
+    def rank(self, targets: list[_Target]) -> list[_Target]:
+        now = time.monotonic()
+        return sorted(targets, key=lambda t: self._score(t, now))
+
+    def _record(self, t: _Target, ms: float | None, throttled: bool, abandoned: threading.Event) -> None:
+        st = self._st(t)
+        with self._lock:
+            st.in_flight = max(0, st.in_flight - 1)
+            if abandoned.is_set():
+                # Lost a hedge race and outlived its invocation: the environment may have been
+                # frozen since, so neither its latency nor a dropped connection says anything
+                return
+            if throttled:
+                st.consecutive_throttles += 1
+                st.throttled_until = time.monotonic() + min(30.0, 0.5 * 2 ** st.consecutive_throttles)
+            elif ms is not None:
+                st.consecutive_throttles = 0
+                st.ewma_ms = ms if st.ewma_ms is None else 0.8 * st.ewma_ms + 0.2 * ms
+
+    def _call(self, t: _Target, body_bytes: bytes, parent_span: dict | None, abandoned: threading.Event):
+        _trace.adopt(parent_span)
+        st = self._st(t)
+        with self._lock:
+            st.in_flight += 1
+        t0 = time.monotonic()
+        runtime, ctl = _clients_for(t.region, t.endpoint_url)
+        try:
+            res = _invoke_with_auto_profile(
+                runtime, ctl, body_bytes=body_bytes,
+                model_id=t.model_id, inference_profile_arn=t.inference_profile_arn,
+            )
+            data = res['body'].read()
+        except ClientError as e:
+            code = (getattr(e, 'response', {}) or {}).get('Error', {}).get('Code')
+            self._record(t, None, code in _THROTTLE_CODES, abandoned)
+            raise
+        except Exception:
+            self._record(t, None, True, abandoned)
+            raise
+        self._record(t, (time.monotonic() - t0) * 1000, False, abandoned)
+        return data
+
+    def invoke(self, targets: list[_Target], body_bytes: bytes, hedge_after_ms: float) -> tuple[bytes, _Target, bool]:
+        """Returns (response body, winning target, hedged?). Fails over down the ranking."""
+        order = self.rank(targets)
+        parent = _trace.current()
+        pending = {}
+        last_err: Exception | None = None
+        hedged = False
+        nxt = 0
+        # Set once this invocation returns; hedge losers finishing later skip _record
+        abandoned = threading.Event()
+
+        def _launch():
+            nonlocal nxt
+            t = order[nxt]
+            nxt += 1
+            pending[_executor.submit(self._call, t, body_bytes, parent, abandoned)] = t
+
+        try:
+            _launch()
+            while pending:
+                can_hedge = nxt < len(order) and hedge_after_ms > 0 and not hedged
+                done, _ = wait(list(pending), timeout=(hedge_after_ms / 1000.0) if can_hedge else None,
+                               return_when=FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    _launch()
+                    continue
+                for f in done:
+                    t = pending.pop(f)
+                    try:
+                        return f.result(), t, hedged
+                    except ClientError as e:
+                        if e.response.get('Error', {}).get('Code') not in _FAILOVER_CODES:
+                            raise
+                        last_err = e
+                    except Exception as e:
+                        last_err = e
+                if not pending and nxt < len(order):
+                    _launch()
+            assert last_err is not None
+            raise last_err
+        finally:
+            abandoned.set()
+            for f in pending:
+                f.cancel()
+
+
+_ROUTER = _Router()
+
+
+def _targets_from(kind: str, model_id: str | None, inference_profile_arn: str | None) -> list[_Target]:
+    """Configured pool for `kind` (embed/generate); targets without a model inherit the resolved one.
+
+    Only read from the environment: the route has no authorizer, and a caller-supplied
+    endpointUrl would let anyone send SigV4-signed requests to an arbitrary host.
+    """
+    raw = os.environ.get(f'BEDROCK_TARGETS_{kind.upper()}')
+    specs = json.loads(raw) if raw else []
+    out = []
+    for s in specs:
+        if not isinstance(s, dict):
+            continue
+        if not s.get('modelId') and not s.get('inferenceProfileArn'):
+            s = {**s, 'modelId': model_id, 'inferenceProfileArn': inference_profile_arn}
+        out.append(_Target(s))
+    return out
+
+
+def _routed_invoke(targets: list[_Target], body_bytes: bytes, payload: dict) -> tuple[dict, dict]:
+    hedge_ms = float(payload.get('hedgeAfterMs') or os.environ.get('HEDGE_AFTER_MS') or 0)
+    with _trace.span('bedrock.route', **{'route.targets': len(targets)}) as attrs:
+        raw, t, hedged = _ROUTER.invoke(targets, body_bytes, hedge_ms)
+        info = {'region': t.region, 'modelId': t.model_id,
+                'inferenceProfileArn': t.inference_profile_arn, 'hedged': hedged}
+        attrs.update({'route.region': t.region, 'route.model_id': t.model_id, 'route.hedged': hedged})
+    return json.loads(raw), info
+
+
+# ---- Prompt caching (Anthropic Messages `cache_control`) ----
+# Bedrock allows at most 4 cache points per request; a later point also covers the prefix before it.
+_MAX_CACHE_POINTS = 4
+_CACHE_CONTROL = {'type': 'ephemeral'}
+
+
+def _messages_prompt(payload: dict, system: str) -> tuple[object, list[dict]] | None:
+    """(system, user content blocks) for the Messages body, honouring cache-point markers.
+
+    `userBlocks` is a list of {"text", "cachePoint"}; `cacheSystem` adds a point after the
+    system prompt. Returns None if neither userText nor valid userBlocks were given.
+    """
+    blocks = payload.get('userBlocks')
+    if blocks is None:
+        user_text = payload.get('userText')
+        if not user_text:
+            return None
+        blocks = [{'text': user_text}]
+    if not isinstance(blocks, list) or not blocks or not all(isinstance(b, dict) and b.get('text') for b in blocks):
+        return None
+    cache_system = bool(payload.get('cacheSystem'))
+    marked = [i for i, b in enumerate(blocks) if b.get('cachePoint')]
+    keep = set(marked[-(_MAX_CACHE_POINTS - int(cache_system)):]) if marked else set()
+    content = []
+    for i, b in enumerate(blocks):
+        item = {'type': 'text', 'text': b['text']}
+        if i in keep:
+            item['cache_control'] = _CACHE_CONTROL
+        content.append(item)
+    if cache_system:
+        return [{'type': 'text', 'text': system, 'cache_control': _CACHE_CONTROL}], content
+    return system, content
+
+
+# Models / profiles that rejected cache_control; later calls to them are sent without it
+_NO_CACHE_MODELS: set = set()
+
+
+def _has_cache_points(system, content: list[dict]) -> bool:
+    blocks = (system if isinstance(system, list) else []) + content
+    return any('cache_control' in b for b in blocks)
+
+
+def _strip_cache_points(system, content: list[dict]) -> tuple[object, list[dict]]:
+    if isinstance(system, list):
+        system = ''.join(b.get('text', '') for b in system)
+    return system, [{k: v for k, v in b.items() if k != 'cache_control'} for b in content]
+
+
+def _usage_summary(data: dict) -> dict | None:
+    """Token counts from a Messages response, including prompt cache reads/writes."""
+    u = data.get('usage') if isinstance(data, dict) else None
+    if not isinstance(u, dict):
+        return None
+    return {
+        'inputTokens': u.get('input_tokens'),
+        'outputTokens': u.get('output_tokens'),
+        'cacheReadInputTokens': u.get('cache_read_input_tokens') or 0,
+        'cacheWriteInputTokens': u.get('cache_creation_input_tokens') or 0,
+    }
+
+
 def _normalize_alias(s: str) -> str:
     return (s or '').strip().lower().replace(' ', '').replace('_', '').replace('/', '').replace('claude', 'claude')
 
@@ -263,6 +644,26 @@ def _extract_text_from_bedrock_response(data: dict) -> str:
     return ''
 
 
+# Map Bedrock error codes to HTTP status so callers can tell throttling/outages from bad input
+_CLIENT_ERROR_STATUS = {
+    'ThrottlingException': 429,
+    'TooManyRequestsException': 429,
+    'ServiceUnavailableException': 503,
+    'ModelNotReadyException': 503,
+    'InternalServerException': 500,
+    'ModelTimeoutException': 504,
+}
+
+
+def _item_error(e: Exception) -> dict:
+    """Per-item error for batch responses; `status` is what the whole request would have returned."""
+    if isinstance(e, ClientError):
+        code = e.response.get('Error', {}).get('Code')
+        return {'error': code, 'message': e.response.get('Error', {}).get('Message'),
+                'status': _CLIENT_ERROR_STATUS.get(code or '', 400)}
+    return {'error': type(e).__name__, 'message': str(e), 'status': 500}
+
+
 def _parse_body(event):
     body = event.get('body')
     if not body:
@@ -293,6 +694,30 @@ def _resp_text(status: int, text: str):
 
 
 def handler(event, context):
+    global _trace, _COLD_START
+    payload = _parse_body(event)
+    hdrs = event.get('headers') or {}
+    _trace = _Trace(hdrs.get('traceparent') or hdrs.get('Traceparent') or payload.get('traceparent'))
+    cold, _COLD_START = _COLD_START, False
+    root = _trace.start(
+        'lambda.handler',
+        start_ns=_INIT_START_NS if cold else None,
+        **{'faas.coldstart': cold, 'bedrock.action': (payload.get('action') or 'generate').lower()},
+    )
+    if cold:
+        # Container init (imports, boto3) up to the first invocation
+        _trace.end(_trace.start('lambda.cold_start', start_ns=_INIT_START_NS))
+    resp = None
+    try:
+        resp = _handle(event, context)
+        return resp
+    finally:
+        root['attributes']['http.status_code'] = resp.get('statusCode') if resp else None
+        _trace.end(root)
+        _trace.export()
+
+
+def _handle(event, context):
     try:
         action = None
         payload = _parse_body(event)
@@ -305,8 +730,12 @@ def handler(event, context):
 
         if action == 'embed':
             text = payload.get('text')
-            if not text:
+            texts = payload.get('texts')
+            if texts is not None and (not isinstance(texts, list) or not all(isinstance(t, str) and t for t in texts)):
+                return _resp(400, {'error': 'texts must be a list of non-empty strings'})
+            if not text and not texts:
                 return _resp(400, {'error': 'text required'})
+            resolve_span = _trace.start('lambda.resolve_model')
             # Allow override from payload
             model_id = (payload.get('modelId')
                         or os.environ.get('EMBEDDING_MODEL_ID'))
@@ -318,29 +747,62 @@ def handler(event, context):
                              or os.environ.get('DEFAULT_EMBEDDING_ALIAS')
                              or 'titan-v2-1024')
                 model_id = _resolve_embedding_model_id(emb_alias)
-            body = json.dumps({'inputText': text})
             # Determine target region from explicit payload or provided ARN if any
             target_region = (payload.get('region')
                              or _arn_region(payload.get('inferenceProfileArn') or os.environ.get('EMBEDDING_INFERENCE_PROFILE_ARN')))
             if target_region and target_region != default_region:
                 bedrock = boto3.client('bedrock-runtime', region_name=target_region)
                 bedrock_ctl = boto3.client('bedrock', region_name=target_region)
-            res = _invoke_with_auto_profile(
-                bedrock,
-                bedrock_ctl,
-                body_bytes=body.encode('utf-8'),
-                model_id=model_id,
-                inference_profile_arn=inference_profile_arn,
-            )
-            data = json.loads(res['body'].read())
-            return _resp(200, {'embedding': data.get('embedding')})
+            resolve_span['attributes'].update({'bedrock.model_id': model_id, 'cloud.region': target_region or default_region})
+            _trace.end(resolve_span)
+
+            targets = _targets_from('embed', model_id, inference_profile_arn)
+
+            def _embed_one(t: str):
+                body = json.dumps({'inputText': t})
+                if targets:
+                    return _routed_invoke(targets, body.encode('utf-8'), payload)[0].get('embedding')
+                res = _invoke_with_auto_profile(
+                    bedrock,
+                    bedrock_ctl,
+                    body_bytes=body.encode('utf-8'),
+                    model_id=model_id,
+                    inference_profile_arn=inference_profile_arn,
+                )
+                return json.loads(res['body'].read()).get('embedding')
+
+            if texts:
+                if len(texts) > _EMBED_BATCH_MAX:
+                    return _resp(400, {'error': f'at most {_EMBED_BATCH_MAX} texts per request'})
+                # Titan takes one input per call: fan out, and report failures per item so the
+                # client resends only those instead of re-embedding the whole batch
+                parent = _trace.current()
+
+                def _embed_item(t: str):
+                    _trace.adopt(parent)
+                    return _embed_one(t)
+
+                futures = [_embed_executor.submit(_embed_item, t) for t in texts]
+                embeddings, errors, first_err = [], [], None
+                for i, f in enumerate(futures):
+                    try:
+                        embeddings.append(f.result())
+                    except Exception as e:
+                        first_err = first_err or e
+                        embeddings.append(None)
+                        errors.append({'index': i, **_item_error(e)})
+                if first_err is not None and len(errors) == len(texts):
+                    raise first_err  # nothing succeeded: map to 429/5xx like a single embed
+                return _resp(200, {'embeddings': embeddings, 'errors': errors})
+            return _resp(200, {'embedding': _embed_one(text)})
 
         if action == 'generate':
-            user_text = payload.get('userText')
-            if not user_text:
-                return _resp(400, {'error': 'userText required'})
             system = payload.get('system') or 'You are a helpful assistant.'
+            prompt = _messages_prompt(payload, system)
+            if prompt is None:
+                return _resp(400, {'error': 'userText or userBlocks required'})
             max_tokens = int(payload.get('maxTokens') or 800)
+            resolve_span = _trace.start('lambda.resolve_model')
             # If region explicitly provided, set clients before any discovery
             requested_region = payload.get('region')
             if requested_region and requested_region != default_region:
@@ -377,28 +839,57 @@ def handler(event, context):
             if target_region and target_region != default_region:
                 bedrock = boto3.client('bedrock-runtime', region_name=target_region)
                 bedrock_ctl = boto3.client('bedrock', region_name=target_region)
-            # Follow Bedrock Claude Messages API format
-            body = json.dumps({
-                'anthropic_version': 'bedrock-2023-05-31',
-                'system': system,
-                'max_tokens': max_tokens,
-                'messages': [
-                    {
-                        'role': 'user',
-                        'content': [{'type': 'text', 'text': user_text}],
-                    }
-                ],
+            resolve_span['attributes'].update({
+                'bedrock.model_id': model_id,
+                'bedrock.inference_profile': inference_profile_arn,
+                'cloud.region': target_region or default_region,
             })
-            res = _invoke_with_auto_profile(
-                bedrock,
-                bedrock_ctl,
-                body_bytes=body.encode('utf-8'),
-                model_id=model_id,
-                inference_profile_arn=inference_profile_arn,
-            )
-            raw_bytes = res['body'].read()
-            data = json.loads(raw_bytes)
+            _trace.end(resolve_span)
+            targets = _targets_from('generate', model_id, inference_profile_arn)
+            model_key = inference_profile_arn or model_id
+            if model_key in _NO_CACHE_MODELS:
+                prompt = _strip_cache_points(*prompt)
+
+            def _invoke_generate(system_part, content) -> tuple[dict, dict | None]:
+                # Follow Bedrock Claude Messages API format
+                body = json.dumps({
+                    'anthropic_version': 'bedrock-2023-05-31',
+                    'system': system_part,
+                    'max_tokens': max_tokens,
+                    'messages': [
+                        {
+                            'role': 'user',
+                            'content': content,
+                        }
+                    ],
+                })
+                if targets:
+                    return _routed_invoke(targets, body.encode('utf-8'), payload)
+                res = _invoke_with_auto_profile(
+                    bedrock,
+                    bedrock_ctl,
+                    body_bytes=body.encode('utf-8'),
+                    model_id=model_id,
+                    inference_profile_arn=inference_profile_arn,
+                )
+                return json.loads(res['body'].read()), None
+
+            try:
+                data, route = _invoke_generate(*prompt)
+            except ClientError as e:
+                # Models without prompt caching reject cache_control: retry once without it
+                if (e.response.get('Error', {}).get('Code') != 'ValidationException'
+                        or not _has_cache_points(*prompt)):
+                    raise
+                print("generate rejected with cache_control, retrying without:", model_key)
+                data, route = _invoke_generate(*_strip_cache_points(*prompt))
+                # Only remember the model once the cache-free request actually succeeded
+                _NO_CACHE_MODELS.add(model_key)
             text = _extract_text_from_bedrock_response(data)
+            usage = _usage_summary(data)
+            if usage:
+                print("bedrock_usage:", json.dumps(usage))
+                _trace.current()['attributes'].update({f'bedrock.usage.{k}': v for k, v in usage.items()})
             try:
                 # Log only lightweight summary to CloudWatch for diagnostics
                 print("bedrock_resp_keys:", list(data.keys())[:10])
@@ -418,7 +909,10 @@ def handler(event, context):
             want_json = bool(payload.get('json')) or ('application/json' in accept_hdr)
 
             if want_json:
-                return _resp(200, {'text': text or None, 'raw': data})
+                out = {'text': text or None, 'raw': data, 'usage': usage}
+                if route:
+                    out['target'] = route
+                return _resp(200, out)
             else:
                 return _resp_text(200, text or '')
 
@@ -481,13 +975,19 @@ def handler(event, context):
         traceback.print_exc()
         # Try to surface Bedrock client errors
         try:
-            from botocore.exceptions import ClientError, ParamValidationError, BotoCoreError
+            # ClientError is imported at module level (a local import would shadow it in all of _handle)
+            from botocore.exceptions import ParamValidationError, BotoCoreError
             if isinstance(e, ParamValidationError):
                 return _resp(400, {'error': 'ParamValidationError', 'message': str(e)})
             if isinstance(e, ClientError):
                 code = e.response.get('Error', {}).get('Code')
                 msg = e.response.get('Error', {}).get('Message')
-                return _resp(400, {'error': code, 'message': msg})
+                status = _CLIENT_ERROR_STATUS.get(code or '', 400)
+                resp = _resp(status, {'error': code, 'message': msg})
+                if status == 429:
+                    # Hint for client-side backoff
+                    resp['headers']['retry-after'] = '1'
+                return resp
             if isinstance(e, BotoCoreError):
                 return _resp(400, {'error': 'BotoCoreError', 'message': str(e)})
         except Exception:
@@ -0,0 +1,110 @@
+"""Fake Bedrock runtime endpoint for exercising the proxy's target routing locally.
+
+Not part of the Lambda bundle. Start one per simulated region and point
+BEDROCK_TARGETS_* at them via `endpointUrl`:
+
+    python fake_bedrock.py --port 9001 --latency-ms 80 --jitter-ms 40 --throttle-rate 0.1
+    python fake_bedrock.py --port 9002 --latency-ms 300
+
+    BEDROCK_TARGETS_GENERATE='[{"region": "us-east-1", "endpointUrl": "http://127.0.0.1:9001"},
+                               {"region": "us-west-2", "endpointUrl": "http://127.0.0.1:9002"}]'
+
+Throttled calls return 429 with `x-amzn-ErrorType: ThrottlingException`, which
+boto3 surfaces as a ClientError just like the real service. Generation usage
+reports prompt cache writes / reads for prefixes ending at a `cache_control`
+block, so cache hit rates can be checked without a real model.
+"""
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _cached_prefix(req: dict) -> str:
+    """Text up to the last `cache_control` block (system first, then the user turn)."""
+    system = req.get('system')
+    blocks = system if isinstance(system, list) else [{'text': system or ''}]
+    for m in req.get('messages') or []:
+        content = m.get('content')
+        blocks = blocks + (content if isinstance(content, list) else [{'text': content or ''}])
+    last = max((i for i, b in enumerate(blocks) if b.get('cache_control')), default=-1)
+    return ''.join(b.get('text', '') for b in blocks[:last + 1])
+
+
+def _make_handler(args: argparse.Namespace):
+    seen_prefixes: set[str] = set()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, fmt, *a):
+            if args.verbose:
+                super().log_message(fmt, *a)
+
+        def _send(self, status: int, obj: dict, headers: dict | None = None) -> None:
+            body = json.dumps(obj).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            req = json.loads(self.rfile.read(length) or b'{}')
+            if not (self.path.startswith('/model/') and self.path.endswith('/invoke')):
+                return self._send(404, {'message': 'not found'}, {'x-amzn-ErrorType': 'ResourceNotFoundException'})
+            time.sleep(max(0.0, args.latency_ms + random.uniform(-args.jitter_ms, args.jitter_ms)) / 1000.0)
+            if random.random() < args.throttle_rate:
+                return self._send(429, {'message': 'Too many requests'}, {'x-amzn-ErrorType': 'ThrottlingException'})
+            if 'inputText' in req:
+                rnd = random.Random(req['inputText'])
+                return self._send(200, {'embedding': [rnd.uniform(-1, 1) for _ in range(args.dim)],
+                                        'inputTextTokenCount': len(req['inputText'].split())})
+            # Rough token counts (~4 chars/token) with prompt cache hits on repeated prefixes
+            prefix = _cached_prefix(req)
+            total = len(json.dumps(req.get('messages'), ensure_ascii=False) + str(req.get('system'))) // 4
+            cached = len(prefix) // 4 if len(prefix) // 4 >= args.cache_min_tokens else 0
+            hit = cached > 0 and prefix in seen_prefixes
+            if cached:
+                seen_prefixes.add(prefix)
+            return self._send(200, {
+                'id': 'msg_fake',
+                'type': 'message',
+                'role': 'assistant',
+                'content': [{'type': 'text', 'text': f'[{args.name}] fake answer'}],
+                'stop_reason': 'end_turn',
+                'usage': {
+                    'input_tokens': total - cached,
+                    'output_tokens': 3,
+                    'cache_read_input_tokens': cached if hit else 0,
+                    'cache_creation_input_tokens': 0 if hit else cached,
+                },
+            })
+
+        def do_GET(self):
+            # bedrock control plane calls (profile discovery) just find nothing
+            self._send(200, {'inferenceProfileSummaries': [], 'modelSummaries': []})
+
+    return Handler
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description='fake Bedrock runtime for routing / hedging tests')
+    ap.add_argument('--port', type=int, default=9001)
+    ap.add_argument('--name', default=None, help='label echoed in generated text (default: port)')
+    ap.add_argument('--latency-ms', type=float, default=100.0)
+    ap.add_argument('--jitter-ms', type=float, default=0.0)
+    ap.add_argument('--throttle-rate', type=float, default=0.0)
+    ap.add_argument('--dim', type=int, default=1024)
+    ap.add_argument('--cache-min-tokens', type=int, default=1024,
+                    help='prefixes shorter than this are not cached (as on Bedrock)')
+    ap.add_argument('--verbose', action='store_true')
+    args = ap.parse_args()
+    args.name = args.name or str(args.port)
+    ThreadingHTTPServer(('127.0.0.1', args.port), _make_handler(args)).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -38,3 +38,39 @@ variable "bedrock_embedding_inference_profile_arn" {
   description = "Inference profile ARN for embedding model (optional)"
   default     = null
 }
+
+variable "lambda_trace_exporter" {
+  type        = string
+  description = "Lambda trace exporter: stdout | otlp | none"
+  default     = "stdout"
+}
+
+variable "lambda_trace_otlp_endpoint" {
+  type        = string
+  description = "OTLP/HTTP traces endpoint used when lambda_trace_exporter = otlp"
+  default     = ""
+}
+
+variable "lambda_trace_sample_ratio" {
+  type        = string
+  description = "Sample ratio for requests arriving without a traceparent"
+  default     = "0"
+}
+
+variable "bedrock_generation_targets" {
+  type        = list(map(string))
+  description = "Generation targets to balance across, e.g. [{region = \"us-west-2\", inferenceProfileArn = \"...\", weight = \"2\"}]; empty = single target"
+  default     = []
+}
+
+variable "bedrock_embedding_targets" {
+  type        = list(map(string))
+  description = "Embedding targets to balance across (same shape as bedrock_generation_targets)"
+  default     = []
+}
+
+variable "bedrock_hedge_after_ms" {
+  type        = string
+  description = "Send a duplicate request to the next target if the first has not answered after this many ms (0 = off)"
+  default     = "0"
+}